@@ -1,19 +1,220 @@
-import base64, json, gzip, httpx, os
+import asyncio, base64, bisect, contextvars, hashlib, heapq, hmac, ipaddress, json, gzip, httpx, os, re, socket, sys, tempfile, time, unicodedata
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, Query, Request
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.background import BackgroundTask
 from typing import Optional
+from urllib.parse import quote, unquote, urljoin, urlsplit
 from dotenv import load_dotenv
 
 load_dotenv()
 
-app = FastAPI(title="Miruro API", version="2.0")
+# Long-running jobs (index harvests, syncs, ...) registered further down and
+# started once the app is serving.
+_BACKGROUND_JOBS = []
+
+
+@asynccontextmanager
+async def _lifespan(app):
+    tasks = [asyncio.create_task(job()) for job in _BACKGROUND_JOBS]
+    yield
+    for task in tasks:
+        task.cancel()
+    if _client is not None:
+        await _client.aclose()
+
+
+app = FastAPI(title="Miruro API", version="2.0", lifespan=_lifespan)
 
 # --- Security Configuration ---
 ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "").split(",")
 API_KEY_NAME = "x-api-key"
 VALID_API_KEY = os.getenv("API_KEY")
 
+# Home page and docs are reachable without an API key or allowed origin.
+# /proxy/hls checks its own URL signature, since players like VLC or mpv send
+# no Origin or Referer.
+PUBLIC_PATHS = frozenset({"/", "/docs", "/redoc", "/openapi.json", "/proxy/hls"})
+
+
+def _compile_origin_matcher(origins: list):
+    """One anchored regex equivalent to `any(value.startswith(o) for o in origins)`."""
+    alternatives = dict.fromkeys(re.escape(o.encode()) for o in origins)
+    return re.compile(b"|".join(alternatives)).match
+
+
+class SecureAPIMiddleware:
+    """API key / Origin / Referer gate as a plain ASGI middleware.
+
+    Avoids BaseHTTPMiddleware, whose per-request task and body re-wrapping cost
+    time under load and get in the way of streaming responses.
+    """
+
+    def __init__(self, app, origins: list = None, api_key: str = None):
+        self.app = app
+        self.origin_matches = _compile_origin_matcher(ALLOWED_ORIGINS if origins is None else origins)
+        api_key = VALID_API_KEY if api_key is None else api_key
+        self.api_key = api_key.encode() if api_key else None
+        self.api_key_header = API_KEY_NAME.encode()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in PUBLIC_PATHS:
+            return await self.app(scope, receive, send)
+
+        api_key = origin = referer = None
+        for name, value in scope["headers"]:
+            if name == self.api_key_header and api_key is None:
+                api_key = value
+            elif name == b"origin" and origin is None:
+                origin = value
+            elif name == b"referer" and referer is None:
+                referer = value
+
+        # 1. Check API Key (constant-time), 2. Check Origin or Referer
+        if (self.api_key and api_key is not None and hmac.compare_digest(api_key, self.api_key)) \
+                or (origin and self.origin_matches(origin)) or (referer and self.origin_matches(referer)):
+            return await self.app(scope, receive, send)
+
+        response = JSONResponse(
+            status_code=403,
+            content={"detail": "Access forbidden: Invalid Origin, Referer, or API Key."}
+        )
+        await response(scope, receive, send)
+
+
+# ─── Admission Control ───────────────────────────────────────────────────────
+#
+# Every request gets a deadline (REQUEST_DEADLINE_MS, or less if the caller
+# sends X-Request-Timeout in ms). Each upstream allows a fixed number of
+# concurrent calls with a bounded queue behind it; calls with less than
+# UPSTREAM_MIN_BUDGET_MS left, or that find the queue full, fail fast with 503
+# + Retry-After. Requests answered from cache never reach a queue, so `/` and
+# cached routes stay fast while cache-miss work is being shed. Background work
+# (harvests, syncs, prefetch, exports) queues behind interactive calls.
+
+REQUEST_DEADLINE_MS = int(os.getenv("REQUEST_DEADLINE_MS", "10000"))
+UPSTREAM_MIN_BUDGET_MS = int(os.getenv("UPSTREAM_MIN_BUDGET_MS", "250"))
+UPSTREAM_QUEUE = int(os.getenv("UPSTREAM_QUEUE", "64"))
+SHED_RETRY_AFTER = int(os.getenv("SHED_RETRY_AFTER", "2"))
+UPSTREAM_TIMEOUT = 15.0
+
+_deadline = contextvars.ContextVar("deadline", default=None)  # monotonic time, None = no deadline
+_background = contextvars.ContextVar("background", default=False)
+
+
+def _deadline_left():
+    """Seconds until the current request's deadline, or None outside a request."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def _mark_background():
+    """Run the rest of the current task as low-priority work without a deadline."""
+    _deadline.set(None)
+    _background.set(True)
+
+
+class _Upstream:
+    """Concurrency limit with a bounded, two-level priority wait queue for one upstream."""
+
+    def __init__(self, name: str, limit: int, queue: int = UPSTREAM_QUEUE):
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.active = 0
+        self._waiters = (deque(), deque())  # interactive, background
+
+    def _shed(self, reason: str):
+        _METRICS[f"upstream_{self.name}_shed_{reason}"] += 1
+        raise HTTPException(
+            status_code=503,
+            detail=f"Upstream {self.name} is overloaded, retry shortly",
+            headers={"Retry-After": str(SHED_RETRY_AFTER)},
+        )
+
+    @asynccontextmanager
+    async def slot(self):
+        """Hold one upstream slot; yields the timeout to use for the call."""
+        await self._acquire()
+        try:
+            left = _deadline_left()
+            yield UPSTREAM_TIMEOUT if left is None else max(min(UPSTREAM_TIMEOUT, left), 0.001)
+        finally:
+            self._release()
+
+    async def _acquire(self):
+        left = _deadline_left()
+        min_budget = UPSTREAM_MIN_BUDGET_MS / 1000
+        if left is not None and left < min_budget:
+            self._shed("deadline")
+        if self.active < self.limit and not any(self._waiters):
+            self.active += 1
+            return
+        if sum(map(len, self._waiters)) >= self.queue:
+            self._shed("queue_full")
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[_background.get()].append(future)
+        _METRICS[f"upstream_{self.name}_queued"] += 1
+        try:
+            await asyncio.wait_for(future, None if left is None else left - min_budget)
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled():
+                self._release()  # handed a slot in the same turn the timeout fired
+            self._shed("deadline")
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release()  # handed a slot just as the caller went away
+            raise
+
+    def _release(self):
+        for waiters in self._waiters:
+            while waiters:
+                future = waiters.popleft()
+                if not future.done():
+                    future.set_result(None)  # the slot passes straight to the waiter
+                    return
+        self.active -= 1
+
+    def stats(self) -> dict:
+        return {"active": self.active, "limit": self.limit, "queued": sum(len(w) for w in self._waiters)}
+
+
+_UPSTREAMS = {
+    "anilist": _Upstream("anilist", int(os.getenv("ANILIST_CONCURRENCY", "8"))),
+    "pipe": _Upstream("pipe", int(os.getenv("PIPE_CONCURRENCY", "16"))),
+    "hls": _Upstream("hls", int(os.getenv("HLS_CONCURRENCY", "32"))),
+    "images": _Upstream("images", int(os.getenv("IMAGE_CONCURRENCY", "16"))),
+}
+
+
+class DeadlineMiddleware:
+    """Sets the request deadline that upstream calls are admitted against."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        budget_ms = REQUEST_DEADLINE_MS
+        for name, value in scope["headers"]:
+            if name == b"x-request-timeout":
+                try:
+                    budget_ms = min(budget_ms, int(value))
+                except ValueError:
+                    pass
+                break
+        token = _deadline.set(time.monotonic() + budget_ms / 1000)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _deadline.reset(token)
+
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=ALLOWED_ORIGINS,
@@ -21,77 +222,87 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-
-@app.middleware("http")
-async def secure_api(request: Request, call_next):
-    # Allow home page (docs) without restrictions
-    if request.url.path in ["/", "/docs", "/redoc", "/openapi.json"]:
-        return await call_next(request)
-
-    # 1. Check API Key
-    api_key = request.headers.get(API_KEY_NAME)
-    if VALID_API_KEY and api_key == VALID_API_KEY:
-        return await call_next(request)
-
-    # 2. Check Origin or Referer
-    origin = request.headers.get("origin")
-    referer = request.headers.get("referer")
-
-    is_allowed = False
-    for allowed in ALLOWED_ORIGINS:
-        if (origin and origin.startswith(allowed)) or (referer and referer.startswith(allowed)):
-            is_allowed = True
-            break
-            
-    if not is_allowed:
-        return JSONResponse(
-            status_code=403,
-            content={"detail": "Access forbidden: Invalid Origin, Referer, or API Key."}
-        )
-
-    return await call_next(request)
+app.add_middleware(DeadlineMiddleware)
+# Added last so it stays outermost, wrapping CORS like the old decorator did
+app.add_middleware(SecureAPIMiddleware)
 
 HEADERS = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)", "Referer": "https://www.miruro.tv/"}
 ANILIST_URL = "https://graphql.anilist.co"
 MIRURO_PIPE_URL = "https://www.miruro.tv/api/secure/pipe"
 
+# Image proxy: with IMAGE_PROXY_BASE set (public URL of this API), AniList CDN
+# images in every response are rewritten to our cached /img route.
+IMAGE_PROXY_BASE = os.getenv("IMAGE_PROXY_BASE", "").rstrip("/")
+IMAGE_PROXY_HOSTS = tuple(h.strip() for h in os.getenv("IMAGE_PROXY_HOSTS", "s4.anilist.co,img.anili.st").split(",") if h.strip())
+_IMAGE_URL_PREFIXES = tuple(f"{scheme}://{host}/" for host in IMAGE_PROXY_HOSTS for scheme in ("https", "http"))
+
 def _proxy_img(url: str) -> str:
-    # Proxy removed — return original image URL
+    """Route an AniList CDN image through /img; other URLs are returned as-is."""
+    if IMAGE_PROXY_BASE and isinstance(url, str) and url.startswith(_IMAGE_URL_PREFIXES):
+        return f"{IMAGE_PROXY_BASE}/img?url={quote(url, safe='')}"
     return url
 
 
 def _proxy_deep_images(obj):
-    # Proxy removed — return data unchanged
+    """Return a copy of a response with every CDN image URL proxied.
+
+    Builds new containers instead of mutating: payloads may come from caches.
+    """
+    if not IMAGE_PROXY_BASE:
+        return obj
+    if isinstance(obj, dict):
+        return {k: _proxy_deep_images(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_proxy_deep_images(v) for v in obj]
+    if isinstance(obj, str):
+        return _proxy_img(obj)
     return obj
 
 def _inject_source_slugs(data: dict, anilist_id: int):
-    """Transform episode IDs into simplified path-based slugs: watch/PROV/ALID/CAT/PREFIX-NUMBER"""
-    providers = data.get("providers", {})
+    """Transform episode IDs into simplified path-based slugs: watch/PROV/ALID/CAT/PREFIX-NUMBER
+
+    Returns a copy — the raw data may be shared with concurrent callers.
+    """
+    data = dict(data)
+    providers = data["providers"] = dict(data.get("providers", {}))
     for provider_name, provider_data in providers.items():
         if not isinstance(provider_data, dict):
             continue
+        provider_data = providers[provider_name] = dict(provider_data)
         episodes = provider_data.get("episodes", {})
         if not isinstance(episodes, dict):
             # Some providers return a flat list — wrap it
-            if isinstance(episodes, list):
-                provider_data["episodes"] = {"sub": episodes}
-                episodes = provider_data["episodes"]
+            if isinstance(episodes, (list, _EpisodeList)):
+                episodes = {"sub": episodes}
             else:
                 continue
+        episodes = provider_data["episodes"] = dict(episodes)
         for category, ep_list in episodes.items():
-            if not isinstance(ep_list, list):
+            if not isinstance(ep_list, (list, _EpisodeList)):
                 continue
+            slugged = []
             for ep in ep_list:
-                if not isinstance(ep, dict):
-                    continue
-                if "id" in ep and "number" in ep:
+                if isinstance(ep, dict) and "id" in ep and "number" in ep:
                     orig_id = ep["id"]
                     prefix = orig_id.split(":")[0] if ":" in orig_id else orig_id
-                    ep["id"] = f"watch/{provider_name}/{anilist_id}/{category}/{prefix}-{ep['number']}"
+                    ep = {**ep, "id": f"watch/{provider_name}/{anilist_id}/{category}/{prefix}-{ep['number']}"}
+                slugged.append(ep)
+            episodes[category] = slugged
     return data
 
 async def _fetch_raw_episodes(anilist_id: int) -> dict:
-    """Internal helper to fetch raw, decoded episode data from Miruro pipe."""
+    """Internal helper to fetch raw, decoded episode data from Miruro pipe.
+
+    Served from the snapshot cache when fresh; concurrent calls for the same
+    anime share one upstream request. The returned dict must be treated as
+    read-only, and its episode lists are compact _EpisodeList objects (iterate
+    them for dicts, or use _expand_episodes for plain JSON).
+    """
+    return (await _episode_snapshot(anilist_id))["data"]
+
+
+async def _pipe_episodes(anilist_id: int) -> dict:
+    """Fetch and decode an episode payload straight from the pipe (no cache)."""
     payload = {
         "path": "episodes",
         "method": "GET",
@@ -100,13 +311,14 @@ async def _fetch_raw_episodes(anilist_id: int) -> dict:
         "version": "0.1.0",
     }
     encoded_req = _encode_pipe_request(payload)
-    async with httpx.AsyncClient(timeout=15.0) as client:
-        res = await client.get(f"{MIRURO_PIPE_URL}?e={encoded_req}", headers=HEADERS)
-        if res.status_code != 200:
-            raise HTTPException(status_code=res.status_code, detail="Pipe request failed")
-        data = _decode_pipe_response(res.text.strip())
-        _deep_translate(data)
-        return data
+    async with _UPSTREAMS["pipe"].slot() as timeout:
+        _METRICS["pipe_requests"] += 1
+        res = await _http().get(f"{MIRURO_PIPE_URL}?e={encoded_req}", headers=HEADERS, timeout=timeout)
+    if res.status_code != 200:
+        raise HTTPException(status_code=res.status_code, detail="Pipe request failed")
+    data = _decode_pipe_response(res.text.strip())
+    _deep_translate(data)
+    return data
 
 # ─── Shared GraphQL Fragments ────────────────────────────────────────────────
 
@@ -135,6 +347,9 @@ MEDIA_LIST_FIELDS = """
     endDate { year month day }
 """
 
+# Also carries everything /anime/{id}/characters (first 25), /relations and
+# /recommendations (first 10) return, so those are answered from the same
+# cached query instead of costing an AniList call each.
 MEDIA_FULL_FIELDS = """
     id
     idMal
@@ -167,10 +382,22 @@ MEDIA_FULL_FIELDS = """
     startDate { year month day }
     endDate { year month day }
     characters(sort: [ROLE, RELEVANCE], perPage: 25) {
+        pageInfo { total currentPage lastPage hasNextPage perPage }
         edges {
             role
-            node { id name { full native } image { large } }
+            node {
+                id
+                name { full native userPreferred }
+                image { large medium }
+                description
+                gender
+                dateOfBirth { year month day }
+                age
+                favourites
+                siteUrl
+            }
             voiceActors(language: JAPANESE) { id name { full native } image { large } languageV2 }
+            allVoiceActors: voiceActors { id name { full native } image { large } languageV2 }
         }
     }
     staff(sort: RELEVANCE, perPage: 25) {
@@ -186,26 +413,36 @@ MEDIA_FULL_FIELDS = """
                 id
                 title { romaji english native }
                 coverImage { large }
+                bannerImage
                 format
                 type
                 status
                 episodes
+                chapters
                 meanScore
+                averageScore
+                popularity
+                startDate { year month day }
             }
         }
     }
     recommendations(sort: RATING_DESC, perPage: 10) {
+        pageInfo { total currentPage lastPage hasNextPage perPage }
         nodes {
             rating
             mediaRecommendation {
                 id
                 title { romaji english native }
-                coverImage { large }
+                coverImage { large extraLarge }
+                bannerImage
                 format
                 episodes
                 status
                 meanScore
                 averageScore
+                popularity
+                genres
+                startDate { year }
             }
         }
     }
@@ -254,21 +491,521 @@ def _decode_pipe_response(encoded_str: str) -> dict:
         raise ValueError("Failed to decode pipe response")
 
 
+_METRICS = Counter()  # exposed by /metrics
+
+_client = None
+_client_loop = None
+
+
+def _http() -> httpx.AsyncClient:
+    """Shared upstream client, so connections and TLS setup are reused across requests."""
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client_loop is not loop:
+        # A client is bound to the loop it first ran on (e.g. a new one per test)
+        _client = httpx.AsyncClient(timeout=15.0, limits=httpx.Limits(max_connections=100, max_keepalive_connections=20))
+        _client_loop = loop
+    return _client
+
+
+class _TTLCache:
+    """Bounded LRU mapping whose entries go stale `ttl` seconds after being set."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self.writes = 0  # lets persisters skip saving an unchanged cache
+
+    def get(self, key, default=None):
+        """Return a fresh value, or `default` if missing or expired."""
+        item = self._data.get(key)
+        if item is None or item[0] < time.monotonic():
+            return default
+        self._data.move_to_end(key)
+        return item[1]
+
+    def peek(self, key, default=None):
+        """Return the value even if it is stale."""
+        item = self._data.get(key)
+        return default if item is None else item[1]
+
+    def set(self, key, value, ttl: float = None):
+        self.writes += 1
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def items(self):
+        """Yield (key, value, seconds left) for every fresh entry."""
+        now = time.monotonic()
+        for key, (expires_at, value) in list(self._data.items()):
+            if expires_at > now:
+                yield key, value, expires_at - now
+
+    def __len__(self):
+        return len(self._data)
+
+
+class _DiskCache:
+    """Size-bounded LRU of files in a `cache` subdirectory of `directory`.
+
+    Only that subdirectory is ever written to or cleaned, so pointing
+    `directory` at a shared place (/tmp, the app dir) is safe. Entries are
+    named `<sha256 key>.<quoted content type>`, which lets the index be
+    rebuilt from disk on first use and the cache survive restarts.
+    """
+
+    _ENTRY = re.compile(r"^([0-9a-f]{64})\.(.+)$")
+    _PART = re.compile(r"^[0-9a-f]{64}\.[0-9a-f]{8}\.part$")
+
+    def __init__(self, directory: str, max_mb: int):
+        self.directory = os.path.join(directory, "cache")
+        self.max_bytes = max_mb * 1024 * 1024
+        self._index = OrderedDict()  # key -> (size, content type, file name)
+        self._bytes = 0
+        self._ready = False
+
+    def _ensure_dir(self):
+        if self._ready:
+            return
+        self._ready = True
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        for entry in os.scandir(self.directory):
+            if self._PART.match(entry.name):
+                self._remove(entry.name)  # left behind by an interrupted write
+                continue
+            match = self._ENTRY.match(entry.name)
+            if match and entry.is_file():
+                stat = entry.stat()
+                entries.append((stat.st_mtime, match.group(1), stat.st_size, unquote(match.group(2)), entry.name))
+        for _, key, size, content_type, name in sorted(entries):  # oldest first, as an LRU
+            self._index[key] = (size, content_type, name)
+            self._bytes += size
+        self._evict()
+
+    def _remove(self, name: str):
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except OSError:
+            pass
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._index:
+            _, (old_size, _, old_name) = self._index.popitem(last=False)
+            self._bytes -= old_size
+            self._remove(old_name)
+
+    def get(self, key: str):
+        """Return (path, content type) for a cached file, or None."""
+        self._ensure_dir()
+        item = self._index.get(key)
+        if item is None:
+            return None
+        path = os.path.join(self.directory, item[2])
+        if not os.path.exists(path):
+            return None
+        self._index.move_to_end(key)
+        return path, item[1]
+
+    def temp_path(self, key: str) -> str:
+        """A unique path to write a file to before handing it to add()."""
+        self._ensure_dir()
+        return os.path.join(self.directory, f"{key}.{os.urandom(4).hex()}.part")
+
+    def add(self, key: str, tmp_path: str, size: int, content_type: str):
+        name = f"{key}.{quote(content_type, safe='')}"
+        os.replace(tmp_path, os.path.join(self.directory, name))
+        if key in self._index:
+            old_size, _, old_name = self._index.pop(key)
+            self._bytes -= old_size
+            if old_name != name:
+                self._remove(old_name)
+        self._index[key] = (size, content_type, name)
+        self._bytes += size
+        self._evict()
+
+
+_inflight = {}  # key -> asyncio.Task shared by concurrent callers
+
+
+def _forget_inflight(key, task):
+    _inflight.pop(key, None)
+    if not task.cancelled():
+        task.exception()  # mark retrieved even if every caller went away
+
+
+async def _shared_call(factory):
+    if _deadline.get() is not None:
+        # The task copied its first caller's context; that caller's (possibly
+        # short) deadline must not fail everyone else sharing the result.
+        _deadline.set(time.monotonic() + REQUEST_DEADLINE_MS / 1000)
+    return await factory()
+
+
+async def _singleflight(key, factory):
+    """Run `factory()` once for all concurrent callers asking for the same key.
+
+    Each caller still gives up at its own deadline; the shared call itself
+    runs with the longest deadline a request can have.
+    """
+    left = _deadline_left()
+    task = _inflight.get(key)
+    if task is None:
+        if left is not None and left < UPSTREAM_MIN_BUDGET_MS / 1000:
+            _deadline_exceeded()  # too little budget to be worth starting
+        task = asyncio.ensure_future(_shared_call(factory))
+        _inflight[key] = task
+        task.add_done_callback(lambda t: _forget_inflight(key, t))
+    # shield: one caller disconnecting or timing out must not cancel the others' request
+    if left is None:
+        return await asyncio.shield(task)
+    try:
+        return await asyncio.wait_for(asyncio.shield(task), max(left, 0))
+    except asyncio.TimeoutError:
+        _deadline_exceeded()
+
+
+def _deadline_exceeded():
+    _METRICS["shared_call_deadline_exceeded"] += 1
+    raise HTTPException(
+        status_code=503,
+        detail="Request deadline exceeded, retry shortly",
+        headers={"Retry-After": str(SHED_RETRY_AFTER)},
+    )
+
+
 def _encode_pipe_request(payload: dict) -> str:
     """Encode a dict into the base64 format expected by the pipe endpoint."""
     return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip('=')
 
 
-async def _anilist_query(query: str, variables: dict = None):
-    """Execute an AniList GraphQL query and return the data."""
+# AniList allows ~90 requests per minute per IP. Interactive requests always go
+# through; background work (catalog sync, harvests, ...) waits for headroom.
+ANILIST_RATE_PER_MIN = int(os.getenv("ANILIST_RATE_PER_MIN", "90"))
+ANILIST_BACKGROUND_RESERVE = int(os.getenv("ANILIST_BACKGROUND_RESERVE", "30"))
+_anilist_calls = deque()  # monotonic timestamps of calls in the last minute
+
+
+def _anilist_budget_left() -> int:
+    """How many AniList calls are still available in the current minute."""
+    cutoff = time.monotonic() - 60
+    while _anilist_calls and _anilist_calls[0] < cutoff:
+        _anilist_calls.popleft()
+    return ANILIST_RATE_PER_MIN - len(_anilist_calls)
+
+
+async def _wait_anilist_budget(reserve: int = 0):
+    """Sleep until more than `reserve` calls are left for this minute."""
+    while _anilist_budget_left() <= reserve:
+        await asyncio.sleep(max(_anilist_calls[0] + 60 - time.monotonic(), 0.1) if _anilist_calls else 0.1)
+
+
+# Identical AniList queries within ANILIST_CACHE_TTL seconds are answered
+# from memory. Cached results are shared, so callers must not mutate them.
+ANILIST_CACHE_TTL = int(os.getenv("ANILIST_CACHE_TTL", "300"))
+ANILIST_CACHE_MAX = int(os.getenv("ANILIST_CACHE_MAX", "2000"))
+_anilist_cache = _TTLCache(ANILIST_CACHE_MAX, ANILIST_CACHE_TTL)
+
+
+def _query_key(query: str, variables: dict = None) -> str:
+    return hashlib.blake2b(json.dumps([query, variables], sort_keys=True).encode(), digest_size=16).hexdigest()
+
+
+async def _anilist_query(query: str, variables: dict = None, cache: bool = True):
+    """Execute an AniList GraphQL query and return the data (cached unless `cache=False`)."""
+    if not cache or ANILIST_CACHE_TTL <= 0:
+        return await _anilist_fetch(query, variables)
+    key = _query_key(query, variables)
+    if key in _prefetched:
+        _note_prefetch_use(key)
+    data = _anilist_cache.get(key)
+    if data is not None:
+        _METRICS["anilist_cache_hits"] += 1
+        return data
+    return await _anilist_fill(key, query, variables)
+
+
+async def _anilist_fill(key: str, query: str, variables: dict = None):
+    """Fetch into the AniList cache, joining an identical fetch already in flight."""
+    async def fetch():
+        data = await _anilist_fetch(query, variables)
+        _anilist_cache.set(key, data)
+        return data
+
+    return await _singleflight(("anilist", key), fetch)
+
+
+async def _anilist_fetch(query: str, variables: dict = None):
     body = {"query": query}
     if variables:
         body["variables"] = variables
-    async with httpx.AsyncClient(timeout=15.0) as client:
-        res = await client.post(ANILIST_URL, json=body)
-        if res.status_code != 200:
-            raise HTTPException(status_code=500, detail="AniList query failed")
-        return res.json().get("data", {})
+    async with _UPSTREAMS["anilist"].slot() as timeout:
+        _anilist_calls.append(time.monotonic())
+        _METRICS["anilist_requests"] += 1
+        res = await _http().post(ANILIST_URL, json=body, timeout=timeout)
+    if res.status_code == 404:
+        raise HTTPException(status_code=404, detail="Not found on AniList")
+    if res.status_code != 200:
+        raise HTTPException(status_code=500, detail="AniList query failed")
+    return res.json().get("data", {})
+
+
+# ─── Negative Cache ──────────────────────────────────────────────────────────
+#
+# Unknown ids, empty episode lists, unresolvable slugs and upstream failures
+# are remembered briefly in their own bounded cache, so repeated misses
+# neither go upstream again nor push real entries out of the other caches.
+
+NEGATIVE_CACHE_TTL = int(os.getenv("NEGATIVE_CACHE_TTL", "60"))
+NEGATIVE_CACHE_MAX = int(os.getenv("NEGATIVE_CACHE_MAX", "5000"))
+NEGATIVE_ERROR_TTL = int(os.getenv("NEGATIVE_ERROR_TTL", "5"))
+
+_negative_cache = _TTLCache(NEGATIVE_CACHE_MAX, NEGATIVE_CACHE_TTL)
+
+
+def _negative_get(key):
+    """Re-raise a remembered error for `key`, or return its remembered value (None if absent)."""
+    hit = _negative_cache.get(key)
+    if hit is None:
+        return None
+    _METRICS["negative_cache_hits"] += 1
+    if isinstance(hit, HTTPException):
+        raise HTTPException(status_code=hit.status_code, detail=hit.detail)
+    return hit
+
+
+def _negative_set(key, value):
+    """Remember a miss: a value to return, or an HTTPException to raise (upstream failures for NEGATIVE_ERROR_TTL only)."""
+    if isinstance(value, HTTPException):
+        if value.status_code == 503:
+            return  # shed by admission control: says nothing about the id
+        # a fresh copy, so the cache doesn't keep the raised one's traceback alive
+        value = HTTPException(status_code=value.status_code, detail=value.detail)
+        if value.status_code != 404:
+            if NEGATIVE_ERROR_TTL > 0:
+                _negative_cache.set(key, value, NEGATIVE_ERROR_TTL)
+            return
+    if NEGATIVE_CACHE_TTL > 0:
+        _negative_cache.set(key, value)
+
+
+# ─── Episode Snapshots ───────────────────────────────────────────────────────
+#
+# Each fetched episode payload is cached together with a hash per
+# (provider, category) list, a version over all lists and, for the last few
+# versions, a digest per episode. That lets /episodes?since=VERSION answer
+# with only the episodes that were added or changed since the client's copy.
+
+EPISODES_TTL = int(os.getenv("EPISODES_TTL", "300"))
+EPISODES_CACHE_MAX = int(os.getenv("EPISODES_CACHE_MAX", "1000"))
+EPISODES_HISTORY = int(os.getenv("EPISODES_HISTORY", "4"))
+
+_episode_snapshots = _TTLCache(EPISODES_CACHE_MAX, EPISODES_TTL)
+_MISSING = object()
+
+
+class _EpisodeList:
+    """An episode list stored column-wise instead of as one dict per episode.
+
+    Field names are interned and held once per list, each field is a tuple of
+    values, and the watch/... slugs are never stored — _inject_source_slugs
+    derives them when a response is built. Iterating yields the original
+    episode dicts.
+    """
+
+    __slots__ = ("fields", "columns")
+
+    def __init__(self, episodes: list):
+        fields = {}
+        for ep in episodes:
+            for key in ep:
+                fields.setdefault(sys.intern(key), None)
+        self.fields = tuple(fields)
+        self.columns = tuple(tuple(ep.get(field, _MISSING) for ep in episodes) for field in self.fields)
+
+    def __len__(self):
+        return len(self.columns[0]) if self.columns else 0
+
+    def __iter__(self):
+        for values in zip(*self.columns):
+            yield {field: value for field, value in zip(self.fields, values) if value is not _MISSING}
+
+    def column(self, field: str) -> tuple:
+        """All values of one field (missing ones as None) without building dicts."""
+        if field not in self.fields:
+            return (None,) * len(self)
+        return tuple(None if v is _MISSING else v for v in self.columns[self.fields.index(field)])
+
+
+def _compact_episodes(data: dict) -> dict:
+    """Copy of an episode payload with every list of episode dicts as an _EpisodeList."""
+    data = dict(data)
+    source = data.get("providers") or {}
+    providers = data["providers"] = {}
+    for provider_name, provider_data in source.items():
+        provider_name = sys.intern(provider_name)
+        if isinstance(provider_data, dict):
+            provider_data = dict(provider_data)
+            episodes = provider_data.get("episodes")
+            if isinstance(episodes, dict):
+                provider_data["episodes"] = {sys.intern(c): _compact_list(l) for c, l in episodes.items()}
+            else:
+                provider_data["episodes"] = _compact_list(episodes)
+        providers[provider_name] = provider_data
+    return data
+
+
+def _compact_list(ep_list):
+    if isinstance(ep_list, list) and all(isinstance(ep, dict) for ep in ep_list):
+        return _EpisodeList(ep_list)
+    return ep_list
+
+
+def _expand_episodes(data: dict) -> dict:
+    """Inverse of _compact_episodes: the plain JSON payload with original IDs."""
+    data = dict(data)
+    providers = data["providers"] = dict(data.get("providers") or {})
+    for provider_name, provider_data in providers.items():
+        if isinstance(provider_data, dict):
+            provider_data = providers[provider_name] = dict(provider_data)
+            episodes = provider_data.get("episodes")
+            if isinstance(episodes, dict):
+                provider_data["episodes"] = {c: list(l) if isinstance(l, _EpisodeList) else l for c, l in episodes.items()}
+            elif isinstance(episodes, _EpisodeList):
+                provider_data["episodes"] = list(episodes)
+    return data
+
+
+def _episode_lists(data: dict):
+    """Yield (provider, category, episodes) for every list in an episode payload."""
+    for provider_name, provider_data in data.get("providers", {}).items():
+        episodes = provider_data.get("episodes") if isinstance(provider_data, dict) else None
+        if isinstance(episodes, (list, _EpisodeList)):
+            episodes = {"sub": episodes}
+        if not isinstance(episodes, dict):
+            continue
+        for category, ep_list in episodes.items():
+            if isinstance(ep_list, (list, _EpisodeList)):
+                yield provider_name, category, ep_list
+
+
+def _digest(obj) -> bytes:
+    return hashlib.blake2b(json.dumps(obj, sort_keys=True, separators=(",", ":")).encode(), digest_size=8).digest()
+
+
+def _build_snapshot(data: dict, previous: dict = None) -> dict:
+    """Hash every list/episode of a raw payload and store it compacted, carrying over history from `previous`."""
+    lists, hashes = {}, {}
+    old_lists = previous["lists"] if previous else {}
+    for provider_name, category, ep_list in _episode_lists(data):
+        key = (provider_name, category)
+        list_hash = _digest(ep_list)
+        old = old_lists.get(key)
+        if old and old[0] == list_hash:
+            lists[key] = old  # unchanged: share the digests with older versions
+        else:
+            eps = {}
+            for index, ep in enumerate(ep_list):
+                number = ep.get("number", index) if isinstance(ep, dict) else index
+                eps[number] = _digest(ep)
+            lists[key] = (list_hash, eps)
+        hashes.setdefault(provider_name, {})[category] = list_hash.hex()
+    version = hashlib.blake2b(b"".join(h for h, _ in (lists[k] for k in sorted(lists))), digest_size=8).hexdigest()
+
+    history = OrderedDict(previous["history"]) if previous else OrderedDict()
+    history[version] = lists
+    while len(history) > EPISODES_HISTORY:
+        history.popitem(last=False)
+    return {"data": _compact_episodes(data), "version": version, "hashes": hashes, "lists": lists, "history": history}
+
+
+async def _episode_snapshot(anilist_id: int) -> dict:
+    snapshot = _episode_snapshots.get(anilist_id)
+    if snapshot is not None:
+        return snapshot
+    snapshot = _negative_get(("episodes", anilist_id))
+    if snapshot is not None:
+        return snapshot
+
+    async def refresh():
+        try:
+            data = await _pipe_episodes(anilist_id)
+        except HTTPException as e:
+            _negative_set(("episodes", anilist_id), e)
+            raise
+        snapshot = _build_snapshot(data, _episode_snapshots.peek(anilist_id))
+        if snapshot["lists"]:
+            _episode_snapshots.set(anilist_id, snapshot)
+        else:
+            _negative_set(("episodes", anilist_id), snapshot)  # no providers (yet)
+        return snapshot
+
+    return await _singleflight(("episodes", anilist_id), refresh)
+
+
+def _episode_delta(snapshot: dict, since: str):
+    """Episodes added or changed since version `since`, or None if it is unknown."""
+    old_lists = snapshot["history"].get(since)
+    if old_lists is None:
+        return None
+    providers, removed = {}, {}
+    for provider_name, category, ep_list in _episode_lists(snapshot["data"]):
+        key = (provider_name, category)
+        list_hash, eps = snapshot["lists"][key]
+        old_hash, old_eps = old_lists.get(key, (None, {}))
+        if list_hash == old_hash:
+            continue
+        changed = []
+        for index, ep in enumerate(ep_list):
+            number = ep.get("number", index) if isinstance(ep, dict) else index
+            if old_eps.get(number) != eps[number]:
+                changed.append(ep)
+        if changed:
+            providers.setdefault(provider_name, {"episodes": {}})["episodes"][category] = changed
+        gone = [n for n in old_eps if n not in eps]
+        if gone:
+            removed.setdefault(provider_name, {})[category] = gone
+    for provider_name, category in old_lists:
+        if (provider_name, category) not in snapshot["lists"]:
+            removed.setdefault(provider_name, {})[category] = list(old_lists[(provider_name, category)][1])
+    return {"providers": providers, "removed": removed}
+
+
+# ─── Cache Persistence ───────────────────────────────────────────────────────
+#
+# Short-lived processes (serverless handlers) can carry the AniList and
+# episode caches across restarts by saving this compact snapshot to disk.
+
+def _export_caches(max_entries: int = None) -> dict:
+    """JSON-serialisable copy of the response caches with absolute expiry times.
+
+    With `max_entries`, only that many most recently used entries per cache.
+    """
+    now = time.time()
+    anilist = list(_anilist_cache.items())[-max_entries:] if max_entries else _anilist_cache.items()
+    episodes = list(_episode_snapshots.items())[-max_entries:] if max_entries else _episode_snapshots.items()
+    return {
+        "anilist": [[key, data, now + ttl] for key, data, ttl in anilist],
+        "episodes": [[anilist_id, _expand_episodes(snap["data"]), now + ttl] for anilist_id, snap, ttl in episodes],
+    }
+
+
+def _import_caches(state: dict):
+    """Load entries saved by _export_caches, skipping the ones that expired since."""
+    now = time.time()
+    for key, data, expires_at in state.get("anilist", []):
+        if expires_at > now:
+            _anilist_cache.set(key, data, expires_at - now)
+    for anilist_id, data, expires_at in state.get("episodes", []):
+        if expires_at > now:
+            _episode_snapshots.set(int(anilist_id), _build_snapshot(data), expires_at - now)
+
+
+def _cache_writes() -> int:
+    return _anilist_cache.writes + _episode_snapshots.writes
 
 
 # ─── Homepage ────────────────────────────────────────────────────────────────
@@ -328,7 +1065,7 @@ async def home():
         </div>
 
         <div class="note" style="background: rgba(16, 185, 129, 0.08); border-color: rgba(16, 185, 129, 0.2); color: #10b981;">
-            <b>Global Image Proxying:</b> All images (covers, banners, posters) are now automatically proxied via <code>serveproxy.com</code> to prevent ISP blocking and CORS issues.
+            <b>Image Proxying:</b> When the server sets <code>IMAGE_PROXY_BASE</code>, all AniList images (covers, banners, characters) are served through the cached <code>/img</code> route. Append <code>&amp;w=150</code> to any proxied image URL for a resized WebP thumbnail.
         </div>
 
         <!-- ───────── SEARCH & DISCOVERY ───────── -->
@@ -411,6 +1148,13 @@ async def home():
             <div class="example">Try: <a target="_blank" href="/schedule">/schedule</a></div>
         </div>
 
+        <div class="endpoint">
+            <div><span class="method">GET</span> <span class="url">/export/{collection}</span> <span class="badge badge-new">NEW</span></div>
+            <div class="desc">Stream a whole collection (trending, popular, upcoming, recent) or a <b>filter</b> result set as NDJSON, one anime per line. Resumable via the <b>cursor</b> lines written after each page.</div>
+            <div class="params">Params: <span>cursor</span>=1, <span>per_page</span>=50, <span>max_pages</span>, plus /filter params for collection=filter</div>
+            <div class="example">Try: <a target="_blank" href="/export/popular?max_pages=2">/export/popular?max_pages=2</a></div>
+        </div>
+
         <!-- ───────── ANIME DETAILS ───────── -->
         <div class="section-title">📖 Anime Details</div>
 
@@ -441,6 +1185,13 @@ async def home():
             <div class="example">Try: <a target="_blank" href="/anime/20/recommendations">/anime/20/recommendations</a></div>
         </div>
 
+        <div class="endpoint">
+            <div><span class="method">GET</span> <span class="url">/anime/{id}/full</span></div>
+            <div class="desc">A whole watch page in one request — the <code>/info</code> payload and the episode list fetched concurrently, plus sources for one episode if asked. A part that fails is replaced by an <b>error</b> object.</div>
+            <div class="params">Params: <span>sources</span>=false, <span>episode</span> (default: first), <span>provider</span> (default: first with that episode), <span>category</span>=sub, <span>proxy</span>=false</div>
+            <div class="example">Try: <a target="_blank" href="/anime/178005/full?sources=true">/anime/178005/full?sources=true</a></div>
+        </div>
+
         <!-- ───────── STREAMING ───────── -->
         <div class="section-title">▶️ Streaming (3-Step Flow)</div>
 
@@ -477,6 +1228,9 @@ async def home():
   }
 }</pre>
             <div class="example">Try: <a target="_blank" href="/episodes/178005">/episodes/178005</a></div>
+            <div class="note">
+                <b>Batch:</b> <code>/episodes?ids=178005,21,20</code> returns a map keyed by AniList ID (with per-item <b>error</b>). Add <code>summary=true</code> for just the latest episode number and count per provider/category.
+            </div>
         </div>
 
         <div class="endpoint" style="border-left-color: #10b981; background: rgba(16, 185, 129, 0.05);">
@@ -502,6 +1256,9 @@ async def home():
         <div class="endpoint" style="border-left-color: #818cf8;">
             <div><span class="step-num">3</span> <span class="url" style="color: #818cf8;">Play the stream</span></div>
             <div class="desc">Take the <b>streams[0].url</b> from Step 2 and feed it into any HLS-compatible player (Video.js, hls.js, VLC, mpv, etc.). Subtitles are either hard-subbed (kiwi/pahe) or provided in the <b>subtitles</b> array (zoro/arc). Use <b>intro/outro</b> timestamps for skip buttons.</div>
+            <div class="note">
+                <b>Referer / CORS blocked?</b> Add <code>?proxy=true</code> to the Step 2 URL — stream URLs then point at <code>/proxy/hls</code>, which fetches with the right Referer, rewrites playlists and caches hot segments.
+            </div>
         </div>
 
         <div class="footer">
@@ -514,6 +1271,552 @@ async def home():
 </html>"""
 
 
+# ─── Suggestion Index ────────────────────────────────────────────────────────
+#
+# Every media object we fetch from AniList (search, filter, collections, info)
+# is folded into a small in-process title index so /suggestions can answer
+# from memory. Word-prefix lookups go through a sorted key list (bisect), typos
+# through a trigram index. AniList is only asked when local recall is too low.
+# New keys land in a small sorted side buffer; merging it into the main list
+# and dropping evicted ids happens in a worker thread, never in a request.
+
+SUGGEST_INDEX_ENABLED = os.getenv("SUGGEST_INDEX", "1") != "0"
+SUGGEST_INDEX_MAX = int(os.getenv("SUGGEST_INDEX_MAX", "20000"))
+SUGGEST_MIN_LOCAL = int(os.getenv("SUGGEST_MIN_LOCAL", "5"))
+SUGGEST_HARVEST_PAGES = int(os.getenv("SUGGEST_HARVEST_PAGES", "10"))
+SUGGEST_HARVEST_INTERVAL = int(os.getenv("SUGGEST_HARVEST_INTERVAL", "21600"))
+SUGGEST_LIMIT = 8
+SUGGEST_PENDING_MAX = 2048
+
+_suggest_entries = {}   # anilist id -> {"item", "popularity", "names"}
+_suggest_keys = []      # sorted (word-suffix of a normalized name, anilist id); replaced, never mutated
+_suggest_pending = []   # sorted keys not yet merged into _suggest_keys
+_suggest_trigrams = {}  # trigram -> set of anilist ids; replaced after evictions
+_suggest_evicted = set()  # ids dropped from _suggest_entries but still in the indexes
+_suggest_compacting = None  # running _compact_suggest_keys task
+
+
+def _normalize_title(title: str) -> str:
+    """Lowercase, strip accents and collapse punctuation to single spaces."""
+    title = unicodedata.normalize("NFKD", title)
+    chars = [c if c.isalnum() else " " for c in title.lower() if not unicodedata.combining(c)]
+    return " ".join("".join(chars).split())
+
+
+def _trigrams(name: str) -> set:
+    padded = f"  {name} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _suggestion_item(media: dict) -> dict:
+    """Shape a media object the way /suggestions returns it."""
+    title = media.get("title") or {}
+    return {
+        "id": media["id"],
+        "title": title.get("english") or title.get("romaji"),
+        "title_romaji": title.get("romaji"),
+        "poster": (media.get("coverImage") or {}).get("large"),
+        "format": media.get("format"),
+        "status": media.get("status"),
+        "year": (media.get("startDate") or {}).get("year"),
+        "episodes": media.get("episodes"),
+    }
+
+
+def _add_suggest_keys(anilist_id: int, names: tuple):
+    for name in names:
+        words = name.split(" ")
+        for i in range(len(words)):
+            bisect.insort(_suggest_pending, (" ".join(words[i:]), anilist_id))
+        for gram in _trigrams(name):
+            _suggest_trigrams.setdefault(gram, set()).add(anilist_id)
+
+
+def _merge_suggest_index(keys: list, pending: list, gone: set, names: Optional[dict]):
+    """Build the next key list, and the trigram index after evictions. Runs in a worker thread."""
+    merged = [k for k in heapq.merge(keys, pending) if k[1] not in gone]
+    if names is None:
+        return merged, None
+    trigrams = {}
+    for anilist_id, id_names in names.items():
+        for name in id_names:
+            for gram in _trigrams(name):
+                trigrams.setdefault(gram, set()).add(anilist_id)
+    return merged, trigrams
+
+
+async def _compact_suggest_keys():
+    """Fold pending keys into _suggest_keys and purge evicted ids, off the event loop."""
+    global _suggest_keys, _suggest_trigrams, _suggest_compacting
+    try:
+        gone = set(_suggest_evicted)
+        _suggest_evicted.clear()
+        pending = list(_suggest_pending)
+        names = {i: e["names"] for i, e in _suggest_entries.items()} if gone else None
+        merged, trigrams = await asyncio.to_thread(_merge_suggest_index, _suggest_keys, pending, gone, names)
+        done = set(pending)
+        _suggest_pending[:] = [k for k in _suggest_pending if k not in done]
+        _suggest_keys = merged
+        if trigrams is not None:
+            # Names indexed while the thread ran only reached the old trigram dict
+            for anilist_id, entry in _suggest_entries.items():
+                old = names.get(anilist_id, ())
+                if entry["names"] is not old:
+                    for name in entry["names"][len(old):]:
+                        for gram in _trigrams(name):
+                            trigrams.setdefault(gram, set()).add(anilist_id)
+            _suggest_trigrams = trigrams
+        # Evicted ids that were indexed again get their current keys back
+        for anilist_id in gone & _suggest_entries.keys():
+            _add_suggest_keys(anilist_id, _suggest_entries[anilist_id]["names"])
+    finally:
+        _suggest_compacting = None
+
+
+def _index_titles(media_list):
+    """Fold AniList media objects into the suggestion index."""
+    global _suggest_compacting
+    if not SUGGEST_INDEX_ENABLED:
+        return
+    for media in media_list or []:
+        if not isinstance(media, dict) or not media.get("id") or not media.get("title"):
+            continue
+        title = media["title"]
+        raw = [title.get("romaji"), title.get("english"), title.get("native"), *(media.get("synonyms") or [])]
+        names = tuple(dict.fromkeys(n for n in map(_normalize_title, filter(None, raw)) if n))
+        if not names:
+            continue
+        anilist_id = media["id"]
+        old = _suggest_entries.get(anilist_id)
+        # Names only ever grow, so keys learnt from richer payloads (e.g.
+        # synonyms from /info) stay valid and nothing has to be removed.
+        new_names = tuple(n for n in names if n not in old["names"]) if old else names
+        _suggest_entries[anilist_id] = {
+            "item": _suggestion_item(media),
+            "popularity": media.get("popularity") or (old or {}).get("popularity") or 0,
+            "names": old["names"] + new_names if old else names,
+        }
+        if new_names:
+            _add_suggest_keys(anilist_id, new_names)
+
+    if len(_suggest_entries) > SUGGEST_INDEX_MAX:
+        # Drop the least popular tenth rather than trimming one at a time
+        # (their keys and trigrams are purged by the next compaction)
+        by_popularity = sorted(_suggest_entries, key=lambda i: _suggest_entries[i]["popularity"])
+        for anilist_id in by_popularity[:len(_suggest_entries) - SUGGEST_INDEX_MAX * 9 // 10]:
+            del _suggest_entries[anilist_id]
+            _suggest_evicted.add(anilist_id)
+    if _suggest_compacting is None and (len(_suggest_pending) > SUGGEST_PENDING_MAX or _suggest_evicted):
+        _suggest_compacting = asyncio.ensure_future(_compact_suggest_keys())
+
+
+def _lookup_titles(query: str, limit: int = SUGGEST_LIMIT) -> list:
+    """Return up to `limit` suggestion items for `query` from the local index."""
+    q = _normalize_title(query)
+    if not q or not _suggest_entries:
+        return []
+
+    # Word-prefix matches: 2 when the whole title starts with q, 1 otherwise
+    scores = {}
+    for keys in (_suggest_keys, _suggest_pending):
+        i = bisect.bisect_left(keys, (q,))
+        while i < len(keys) and keys[i][0].startswith(q):
+            key, anilist_id = keys[i]
+            i += 1
+            entry = _suggest_entries.get(anilist_id)
+            if entry is None:
+                continue  # evicted, key not compacted away yet
+            score = 2.0 if key in entry["names"] else 1.0
+            if score > scores.get(anilist_id, 0):
+                scores[anilist_id] = score
+
+    # Fuzzy fallback on trigram overlap for typos / partial words
+    if len(scores) < limit and len(q) >= 3:
+        grams = _trigrams(q)
+        overlap = {}
+        for gram in grams:
+            for anilist_id in _suggest_trigrams.get(gram, ()):
+                overlap[anilist_id] = overlap.get(anilist_id, 0) + 1
+        for anilist_id, hits in overlap.items():
+            similarity = hits / len(grams)
+            if similarity >= 0.5 and anilist_id not in scores and anilist_id in _suggest_entries:
+                scores[anilist_id] = similarity
+
+    ranked = sorted(scores, key=lambda i: (-scores[i], -_suggest_entries[i]["popularity"]))
+    return [_suggest_entries[i]["item"] for i in ranked[:limit]]
+
+
+async def _harvest_popular_titles():
+    """Periodically seed the suggestion index with the most popular titles."""
+    gql = """
+    query ($page: Int) {
+        Page(page: $page, perPage: 50) {
+            pageInfo { hasNextPage }
+            media(type: ANIME, sort: [POPULARITY_DESC]) {
+                id
+                title { romaji english native }
+                synonyms
+                coverImage { large }
+                format
+                status
+                startDate { year }
+                episodes
+                popularity
+            }
+        }
+    }
+    """
+    _mark_background()
+    while True:
+        for page in range(1, SUGGEST_HARVEST_PAGES + 1):
+            try:
+                data = await _anilist_query(gql, {"page": page}, cache=False)
+            except Exception:
+                break
+            page_data = data.get("Page", {})
+            _index_titles(page_data.get("media", []))
+            if not page_data.get("pageInfo", {}).get("hasNextPage"):
+                break
+            await _wait_anilist_budget(ANILIST_BACKGROUND_RESERVE)
+        await asyncio.sleep(SUGGEST_HARVEST_INTERVAL)
+
+
+if SUGGEST_INDEX_ENABLED and SUGGEST_HARVEST_PAGES > 0:
+    _BACKGROUND_JOBS.append(_harvest_popular_titles)
+
+
+# ─── Local Catalog ───────────────────────────────────────────────────────────
+#
+# Optional SQLite mirror of every ANIME media (MEDIA_LIST_FIELDS shape), kept
+# fresh by paging AniList with UPDATED_AT_DESC until we reach the last synced
+# timestamp. Once the first full sync finished, /filter and the collection
+# routes are answered from it. Enable by pointing CATALOG_DB at a file.
+
+CATALOG_DB = os.getenv("CATALOG_DB")
+CATALOG_SYNC_INTERVAL = int(os.getenv("CATALOG_SYNC_INTERVAL", "3600"))
+CATALOG_TRENDING_PAGES = int(os.getenv("CATALOG_TRENDING_PAGES", "4"))
+
+# SORT_MAP key -> indexed column
+_CATALOG_SORT_COLUMNS = {
+    "SCORE_DESC": "score",
+    "POPULARITY_DESC": "popularity",
+    "TRENDING_DESC": "trending",
+    "START_DATE_DESC": "start_date",
+    "FAVOURITES_DESC": "favourites",
+    "UPDATED_AT_DESC": "updated_at",
+}
+
+_CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS media (
+    id INTEGER PRIMARY KEY,
+    updated_at INTEGER,
+    season_year INTEGER,
+    season TEXT,
+    format TEXT,
+    status TEXT,
+    score INTEGER,
+    popularity INTEGER,
+    trending INTEGER,
+    favourites INTEGER,
+    start_date INTEGER,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS media_genre (
+    genre TEXT COLLATE NOCASE, media_id INTEGER, PRIMARY KEY (genre, media_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS media_tag (
+    tag TEXT COLLATE NOCASE, media_id INTEGER, PRIMARY KEY (tag, media_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE INDEX IF NOT EXISTS media_season_year ON media (season_year);
+CREATE INDEX IF NOT EXISTS media_season ON media (season);
+CREATE INDEX IF NOT EXISTS media_format ON media (format);
+CREATE INDEX IF NOT EXISTS media_status ON media (status);
+CREATE INDEX IF NOT EXISTS media_score ON media (score);
+CREATE INDEX IF NOT EXISTS media_popularity ON media (popularity);
+CREATE INDEX IF NOT EXISTS media_trending ON media (trending);
+CREATE INDEX IF NOT EXISTS media_favourites ON media (favourites);
+CREATE INDEX IF NOT EXISTS media_start_date ON media (start_date);
+CREATE INDEX IF NOT EXISTS media_updated_at ON media (updated_at);
+"""
+
+# sqlite3 connections are not meant to be shared between threads, so every
+# catalog read and write runs on this single worker.
+_catalog_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="catalog")
+_catalog_conn = None
+_catalog_synced = False
+
+
+def _catalog_db():
+    global _catalog_conn, _catalog_synced
+    if _catalog_conn is None:
+        import sqlite3  # only needed with CATALOG_DB; keeps cold starts lean
+        conn = sqlite3.connect(CATALOG_DB, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA mmap_size=268435456")
+        conn.executescript(_CATALOG_SCHEMA)
+        row = conn.execute("SELECT value FROM meta WHERE key = 'synced'").fetchone()
+        _catalog_synced = bool(row and row[0] == "1")
+        _catalog_conn = conn
+    return _catalog_conn
+
+
+async def _run_catalog(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(_catalog_executor, fn, *args)
+
+
+def _catalog_ready() -> bool:
+    """True when the catalog is enabled and holds a complete first sync."""
+    return bool(CATALOG_DB) and _catalog_synced
+
+
+def _catalog_meta(key: str, default: str = None) -> str:
+    row = _catalog_db().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else default
+
+
+def _catalog_set_meta(values: dict):
+    conn = _catalog_db()
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", list(values.items()))
+
+
+def _catalog_upsert(media_list: list):
+    """Insert or refresh a page of synced media, including genre and tag rows."""
+    conn = _catalog_db()
+    with conn:
+        for media in media_list:
+            media = dict(media)
+            updated_at = media.pop("updatedAt", None)
+            trending = media.pop("trending", None)
+            tags = [t["name"] for t in media.pop("tags", None) or [] if t and t.get("name")]
+            start = media.get("startDate") or {}
+            start_date = (start.get("year") or 0) * 10000 + (start.get("month") or 0) * 100 + (start.get("day") or 0)
+            conn.execute(
+                "INSERT OR REPLACE INTO media VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    media["id"], updated_at, media.get("seasonYear"), media.get("season"),
+                    media.get("format"), media.get("status"), media.get("averageScore"),
+                    media.get("popularity"), trending, media.get("favourites"), start_date or None,
+                    json.dumps(media, separators=(",", ":")),
+                ),
+            )
+            conn.execute("DELETE FROM media_genre WHERE media_id = ?", (media["id"],))
+            conn.execute("DELETE FROM media_tag WHERE media_id = ?", (media["id"],))
+            conn.executemany(
+                "INSERT OR IGNORE INTO media_genre VALUES (?, ?)",
+                [(g, media["id"]) for g in media.get("genres") or []],
+            )
+            conn.executemany("INSERT OR IGNORE INTO media_tag VALUES (?, ?)", [(t, media["id"]) for t in tags])
+
+
+def _catalog_set_trending(rows: list):
+    """Replace trending scores — they move without bumping updatedAt."""
+    conn = _catalog_db()
+    with conn:
+        conn.execute("UPDATE media SET trending = 0 WHERE trending > 0")
+        conn.executemany("UPDATE media SET trending = ? WHERE id = ?", rows)
+
+
+def _catalog_page(filters: dict, sort: str, page: int, per_page: int) -> Optional[dict]:
+    """Answer a filter/collection page from the catalog in the AniList page shape.
+
+    Returns None when the catalog can't order the page (trending past the
+    refreshed CATALOG_TRENDING_PAGES), so the caller asks AniList instead.
+    """
+    where, params = [], []
+    if filters.get("genre"):
+        where.append("id IN (SELECT media_id FROM media_genre WHERE genre = ?)")
+        params.append(filters["genre"])
+    if filters.get("tag"):
+        where.append("id IN (SELECT media_id FROM media_tag WHERE tag = ?)")
+        params.append(filters["tag"])
+    for key, column in (("seasonYear", "season_year"), ("season", "season"), ("format", "format"), ("status", "status")):
+        if filters.get(key):
+            where.append(f"{column} = ?")
+            params.append(filters[key])
+    column = _CATALOG_SORT_COLUMNS.get(sort, "popularity")
+    if column == "trending":
+        # Only the top trending titles get a score; everything else is 0
+        where.append("trending > 0")
+    clause = f"WHERE {' AND '.join(where)}" if where else ""
+
+    conn = _catalog_db()
+    total = conn.execute(f"SELECT COUNT(*) FROM media {clause}", params).fetchone()[0]
+    if column == "trending" and page * per_page >= total:
+        return None
+    rows = conn.execute(
+        f"SELECT data FROM media {clause} ORDER BY {column} DESC, id DESC LIMIT ? OFFSET ?",
+        params + [per_page, (page - 1) * per_page],
+    ).fetchall()
+    now = int(time.time())
+    return {
+        "page": page,
+        "perPage": per_page,
+        "total": total,
+        "hasNextPage": page * per_page < total,
+        "results": [_catalog_media(r[0], now) for r in rows],
+    }
+
+
+def _catalog_media(data: str, now: int) -> dict:
+    """Load a stored media object with its airing countdown brought up to date."""
+    media = json.loads(data)
+    # Rows only refresh when updatedAt moves, which an episode airing doesn't do
+    airing = media.get("nextAiringEpisode")
+    if airing and airing.get("airingAt"):
+        if airing["airingAt"] <= now:
+            media["nextAiringEpisode"] = None
+        else:
+            airing["timeUntilAiring"] = airing["airingAt"] - now
+    return media
+
+
+async def _sync_catalog_once():
+    """Pull every media updated since the last sync (everything on first run)."""
+    global _catalog_synced
+    gql = f"""
+    query ($page: Int) {{
+        Page(page: $page, perPage: 50) {{
+            pageInfo {{ hasNextPage }}
+            media(type: ANIME, sort: [UPDATED_AT_DESC]) {{
+                {MEDIA_LIST_FIELDS}
+                updatedAt
+                trending
+                tags {{ name }}
+            }}
+        }}
+    }}
+    """
+    watermark = int(await _run_catalog(_catalog_meta, "updated_at", "0"))
+    page = int(await _run_catalog(_catalog_meta, "resume_page", "1"))
+    newest = int(await _run_catalog(_catalog_meta, "resume_newest", "0"))
+    while True:
+        await _wait_anilist_budget(ANILIST_BACKGROUND_RESERVE)
+        page_data = (await _anilist_query(gql, {"page": page}, cache=False)).get("Page", {})
+        media = page_data.get("media", [])
+        await _run_catalog(_catalog_upsert, media)
+        newest = max([newest] + [m.get("updatedAt") or 0 for m in media])
+        reached = watermark and any((m.get("updatedAt") or 0) <= watermark for m in media)
+        if reached or not page_data.get("pageInfo", {}).get("hasNextPage"):
+            break
+        page += 1
+        # Checkpoint so an interrupted first sync resumes instead of restarting
+        await _run_catalog(_catalog_set_meta, {"resume_page": str(page), "resume_newest": str(newest)})
+    await _run_catalog(_catalog_set_meta, {
+        "updated_at": str(newest), "resume_page": "1", "resume_newest": "0", "synced": "1",
+    })
+    _catalog_synced = True
+
+    rows = []
+    for page in range(1, CATALOG_TRENDING_PAGES + 1):
+        await _wait_anilist_budget(ANILIST_BACKGROUND_RESERVE)
+        data = await _anilist_query(
+            "query ($page: Int) { Page(page: $page, perPage: 50) { media(type: ANIME, sort: [TRENDING_DESC]) { id trending } } }",
+            {"page": page},
+            cache=False,
+        )
+        rows += [(m["trending"], m["id"]) for m in data.get("Page", {}).get("media", [])]
+    if rows:
+        await _run_catalog(_catalog_set_trending, rows)
+
+
+async def _sync_catalog():
+    _mark_background()
+    await _run_catalog(_catalog_db)
+    while True:
+        try:
+            await _sync_catalog_once()
+        except Exception:
+            _METRICS["catalog_sync_errors"] += 1
+        await asyncio.sleep(CATALOG_SYNC_INTERVAL)
+
+
+if CATALOG_DB:
+    _BACKGROUND_JOBS.append(_sync_catalog)
+
+
+# ─── Next-Page Prefetch ──────────────────────────────────────────────────────
+#
+# After serving page N of a paginated AniList listing, page N+1 is fetched into
+# the AniList cache in the background. Prefetching only happens with spare rate
+# budget, and switches itself off while too few prefetched pages get requested
+# (still trying one in PREFETCH_PROBE_EVERY so it can switch back on).
+
+PREFETCH_ENABLED = os.getenv("PREFETCH", "1") != "0"
+PREFETCH_MIN_HIT_RATE = float(os.getenv("PREFETCH_MIN_HIT_RATE", "0.3"))
+PREFETCH_WINDOW = int(os.getenv("PREFETCH_WINDOW", "50"))
+PREFETCH_SETTLE = int(os.getenv("PREFETCH_SETTLE", "60"))
+PREFETCH_PROBE_EVERY = int(os.getenv("PREFETCH_PROBE_EVERY", "10"))
+PREFETCH_MIN_SAMPLES = 10
+
+_prefetched = OrderedDict()  # cache key -> [issued_at, used], last PREFETCH_WINDOW prefetches
+_prefetch_tasks = set()
+_prefetch_skips = 0
+
+
+def _note_prefetch_use(key: str):
+    entry = _prefetched[key]
+    if not entry[1]:
+        entry[1] = True
+        _METRICS["prefetch_hits"] += 1
+
+
+def _prefetch_hit_rate():
+    """Share of settled prefetches (used, or older than PREFETCH_SETTLE) that were used."""
+    cutoff = time.monotonic() - PREFETCH_SETTLE
+    settled = used = 0
+    for issued_at, was_used in _prefetched.values():
+        if was_used or issued_at < cutoff:
+            settled += 1
+            used += was_used
+    return used / settled if settled >= PREFETCH_MIN_SAMPLES else None
+
+
+def _prefetch_active() -> bool:
+    rate = _prefetch_hit_rate()
+    return rate is None or rate >= PREFETCH_MIN_HIT_RATE
+
+
+def _prefetch_next(query: str, variables: dict, has_next_page: bool):
+    """Warm the cache with the page after `variables["page"]` if it is likely worth it."""
+    global _prefetch_skips
+    if not PREFETCH_ENABLED or not has_next_page or ANILIST_CACHE_TTL <= 0:
+        return
+    next_vars = {**variables, "page": variables["page"] + 1}
+    key = _query_key(query, next_vars)
+    if ("anilist", key) in _inflight or _anilist_cache.get(key) is not None:
+        return
+    if not _prefetch_active():
+        _prefetch_skips += 1
+        if _prefetch_skips % PREFETCH_PROBE_EVERY:
+            _METRICS["prefetch_skipped_low_hit_rate"] += 1
+            return
+    if _anilist_budget_left() <= ANILIST_BACKGROUND_RESERVE:
+        _METRICS["prefetch_skipped_budget"] += 1
+        return
+
+    _prefetched[key] = [time.monotonic(), False]
+    _prefetched.move_to_end(key)
+    while len(_prefetched) > PREFETCH_WINDOW:
+        _prefetched.popitem(last=False)
+    _METRICS["prefetch_issued"] += 1
+    task = asyncio.ensure_future(_prefetch_fill(key, query, next_vars))
+    _prefetch_tasks.add(task)
+    task.add_done_callback(_prefetch_done)
+
+
+async def _prefetch_fill(key: str, query: str, variables: dict):
+    _mark_background()
+    return await _anilist_fill(key, query, variables)
+
+
+def _prefetch_done(task):
+    _prefetch_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        _METRICS["prefetch_errors"] += 1
+
+
 # ─── Search & Suggestions ───────────────────────────────────────────────────
 
 @app.get("/search")
@@ -533,7 +1836,8 @@ async def search_anime(
         }}
     }}
     """
-    data = await _anilist_query(gql, {"search": query, "page": page, "perPage": per_page})
+    variables = {"search": query, "page": page, "perPage": per_page}
+    data = await _anilist_query(gql, variables)
     page_data = data.get("Page", {})
     page_info = page_data.get("pageInfo", {})
     response = {
@@ -543,6 +1847,8 @@ async def search_anime(
         "hasNextPage": page_info.get("hasNextPage", False),
         "results": page_data.get("media", []),
     }
+    _prefetch_next(gql, variables, response["hasNextPage"])
+    _index_titles(response["results"])
     return _proxy_deep_images(response)
 
 
@@ -550,35 +1856,32 @@ async def search_anime(
 async def search_suggestions(
     query: str = Query(..., min_length=1, description="Search query for autocomplete"),
 ):
-    """Lightweight search for dropdown autocomplete — returns minimal data fast."""
+    """Lightweight search for dropdown autocomplete — served from the local title index when it has enough hits."""
     gql = """
     query ($search: String) {
         Page(page: 1, perPage: 8) {
             media(search: $search, type: ANIME, sort: SEARCH_MATCH) {
                 id
-                title { romaji english }
+                title { romaji english native }
+                synonyms
                 coverImage { large }
                 format
                 status
                 startDate { year }
                 episodes
+                popularity
             }
         }
     }
     """
+    local = _lookup_titles(query) if SUGGEST_INDEX_ENABLED else []
+    if len(local) >= min(SUGGEST_MIN_LOCAL, SUGGEST_LIMIT):
+        return _proxy_deep_images({"suggestions": local})
+
     data = await _anilist_query(gql, {"search": query})
-    results = []
-    for item in data.get("Page", {}).get("media", []):
-        results.append({
-            "id": item["id"],
-            "title": item["title"].get("english") or item["title"].get("romaji"),
-            "title_romaji": item["title"].get("romaji"),
-            "poster": item["coverImage"]["large"],
-            "format": item.get("format"),
-            "status": item.get("status"),
-            "year": (item.get("startDate") or {}).get("year"),
-            "episodes": item.get("episodes"),
-        })
+    media = data.get("Page", {}).get("media", [])
+    _index_titles(media)
+    results = [_suggestion_item(item) for item in media]
     return _proxy_deep_images({"suggestions": results})
 
 
@@ -606,6 +1909,13 @@ async def filter_anime(
     per_page: int = Query(20, ge=1, le=50),
 ):
     """Advanced anime filter with genre, tag, year, season, format, status, and sort."""
+    return await _fetch_filter(genre, tag, year, season, format, status, sort, page, per_page, prefetch=True)
+
+
+async def _fetch_filter(
+    genre, tag, year, season, format, status, sort, page, per_page, prefetch: bool = False, cache: bool = True,
+):
+    """Internal helper behind /filter and its export (which passes cache=False)."""
     # Build dynamic argument string
     args = ["type: ANIME", f"sort: [{SORT_MAP.get(sort, 'POPULARITY_DESC')}]"]
     variables = {"page": page, "perPage": per_page}
@@ -629,6 +1939,11 @@ async def filter_anime(
         args.append("status: $status")
         variables["status"] = status.upper()
 
+    if _catalog_ready():
+        response = await _run_catalog(_catalog_page, variables, SORT_MAP.get(sort, "POPULARITY_DESC"), page, per_page)
+        if response is not None:
+            return _proxy_deep_images(response)
+
     # Build variable type declarations
     var_types = ["$page: Int", "$perPage: Int"]
     if genre:
@@ -654,7 +1969,7 @@ async def filter_anime(
         }}
     }}
     """
-    data = await _anilist_query(gql, variables)
+    data = await _anilist_query(gql, variables, cache=cache)
     page_data = data.get("Page", {})
     page_info = page_data.get("pageInfo", {})
     response = {
@@ -664,13 +1979,23 @@ async def filter_anime(
         "hasNextPage": page_info.get("hasNextPage", False),
         "results": page_data.get("media", []),
     }
+    if prefetch:
+        _prefetch_next(gql, variables, response["hasNextPage"])
+    _index_titles(response["results"])
     return _proxy_deep_images(response)
 
 
 # ─── Collection Endpoints (with pagination) ─────────────────────────────────
 
-async def _fetch_collection(sort_type: str, status: str = None, page: int = 1, per_page: int = 20):
+async def _fetch_collection(
+    sort_type: str, status: str = None, page: int = 1, per_page: int = 20, prefetch: bool = False, cache: bool = True,
+):
     """Internal helper for fetching collections like trending, popular, etc."""
+    if _catalog_ready():
+        response = await _run_catalog(_catalog_page, {"status": status}, sort_type, page, per_page)
+        if response is not None:
+            return _proxy_deep_images(response)
+
     status_filter = f", status: {status}" if status else ""
     gql = f"""
     query ($page: Int, $perPage: Int) {{
@@ -682,7 +2007,8 @@ async def _fetch_collection(sort_type: str, status: str = None, page: int = 1, p
         }}
     }}
     """
-    data = await _anilist_query(gql, {"page": page, "perPage": per_page})
+    variables = {"page": page, "perPage": per_page}
+    data = await _anilist_query(gql, variables, cache=cache)
     page_data = data.get("Page", {})
     page_info = page_data.get("pageInfo", {})
     response = {
@@ -692,6 +2018,9 @@ async def _fetch_collection(sort_type: str, status: str = None, page: int = 1, p
         "hasNextPage": page_info.get("hasNextPage", False),
         "results": page_data.get("media", []),
     }
+    if prefetch:
+        _prefetch_next(gql, variables, response["hasNextPage"])
+    _index_titles(response["results"])
     return _proxy_deep_images(response)
 
 
@@ -709,6 +2038,7 @@ async def get_spotlight():
     """
     data = await _anilist_query(gql)
     media = data.get("Page", {}).get("media", [])
+    _index_titles(media)
     return _proxy_deep_images({"results": media})
 
 
@@ -718,7 +2048,7 @@ async def get_trending(
     per_page: int = Query(20, ge=1, le=50),
 ):
     """Get trending anime with full metadata and pagination."""
-    return await _fetch_collection("TRENDING_DESC", page=page, per_page=per_page)
+    return await _fetch_collection("TRENDING_DESC", page=page, per_page=per_page, prefetch=True)
 
 
 @app.get("/popular")
@@ -727,7 +2057,7 @@ async def get_popular(
     per_page: int = Query(20, ge=1, le=50),
 ):
     """Get most popular anime of all time with full metadata and pagination."""
-    return await _fetch_collection("POPULARITY_DESC", page=page, per_page=per_page)
+    return await _fetch_collection("POPULARITY_DESC", page=page, per_page=per_page, prefetch=True)
 
 
 @app.get("/upcoming")
@@ -745,7 +2075,7 @@ async def get_recent(
     per_page: int = Query(20, ge=1, le=50),
 ):
     """Get currently airing anime with full metadata and pagination."""
-    return await _fetch_collection("START_DATE_DESC", "RELEASING", page=page, per_page=per_page)
+    return await _fetch_collection("START_DATE_DESC", "RELEASING", page=page, per_page=per_page, prefetch=True)
 
 
 @app.get("/schedule")
@@ -774,11 +2104,12 @@ async def get_schedule(
     page_info = page_data.get("pageInfo", {})
     results = []
     for item in page_data.get("airingSchedules", []):
-        entry = item.get("media", {})
-        entry["next_episode"] = item.get("episode")
-        entry["airingAt"] = item.get("airingAt")
-        entry["timeUntilAiring"] = item.get("timeUntilAiring")
-        results.append(entry)
+        results.append({
+            **(item.get("media") or {}),
+            "next_episode": item.get("episode"),
+            "airingAt": item.get("airingAt"),
+            "timeUntilAiring": item.get("timeUntilAiring"),
+        })
     response = {
         "page": page_info.get("currentPage", page),
         "perPage": page_info.get("perPage", per_page),
@@ -786,25 +2117,162 @@ async def get_schedule(
         "hasNextPage": page_info.get("hasNextPage", False),
         "results": results,
     }
+    _index_titles(results)
     return _proxy_deep_images(response)
 
 
+# ─── Bulk Export ─────────────────────────────────────────────────────────────
+
+EXPORT_CONCURRENCY = int(os.getenv("EXPORT_CONCURRENCY", "4"))
+
+# Collection name -> (sort, status) for _fetch_collection
+EXPORT_COLLECTIONS = {
+    "trending": ("TRENDING_DESC", None),
+    "popular": ("POPULARITY_DESC", None),
+    "upcoming": ("POPULARITY_DESC", "NOT_YET_RELEASED"),
+    "recent": ("START_DATE_DESC", "RELEASING"),
+}
+
+
+async def _export_lines(fetch_page, cursor: int, max_pages: Optional[int]):
+    """Yield NDJSON lines for consecutive pages, fetched up to EXPORT_CONCURRENCY ahead.
+
+    Pages are emitted in order; only the in-flight window is held in memory.
+    After every page a ``{"cursor": N}`` line tells the client where to resume
+    (``null`` once the export is complete).
+    """
+    last = cursor + max_pages - 1 if max_pages else None
+    window = deque()
+    next_page = cursor
+
+    async def fetch(page):
+        _mark_background()  # runs in its own task; outlives the request deadline
+        if not _catalog_ready():
+            await _wait_anilist_budget(ANILIST_BACKGROUND_RESERVE)
+        return await fetch_page(page)
+
+    def schedule():
+        nonlocal next_page
+        while len(window) < EXPORT_CONCURRENCY and (last is None or next_page <= last):
+            window.append((next_page, asyncio.create_task(fetch(next_page))))
+            next_page += 1
+
+    try:
+        schedule()
+        while window:
+            page, task = window.popleft()
+            try:
+                response = await task
+            except HTTPException as e:
+                yield json.dumps({"error": e.detail, "cursor": page}) + "\n"
+                return
+            except Exception:
+                yield json.dumps({"error": "Upstream request failed", "cursor": page}) + "\n"
+                return
+            for media in response["results"]:
+                yield json.dumps(media, separators=(",", ":")) + "\n"
+            yield json.dumps({"cursor": page + 1 if response["hasNextPage"] else None}) + "\n"
+            if not response["hasNextPage"]:
+                return
+            schedule()
+    finally:
+        for _, task in window:
+            task.cancel()
+
+
+@app.get("/export/{collection}")
+async def export_collection(
+    collection: str,
+    genre: Optional[str] = Query(None, description="Only for collection=filter"),
+    tag: Optional[str] = Query(None, description="Only for collection=filter"),
+    year: Optional[int] = Query(None, description="Only for collection=filter"),
+    season: Optional[str] = Query(None, description="Only for collection=filter"),
+    format: Optional[str] = Query(None, description="Only for collection=filter"),
+    status: Optional[str] = Query(None, description="Only for collection=filter"),
+    sort: str = Query("POPULARITY_DESC", description="Only for collection=filter"),
+    cursor: int = Query(1, ge=1, description="Page to start from (resume point)"),
+    per_page: int = Query(50, ge=1, le=50),
+    max_pages: Optional[int] = Query(None, ge=1, description="Stop after this many pages"),
+):
+    """Stream a whole collection (trending, popular, upcoming, recent) or filter result set as NDJSON."""
+    if collection == "filter":
+        async def fetch_page(page):
+            return await _fetch_filter(genre, tag, year, season, format, status, sort, page, per_page, cache=False)
+    elif collection in EXPORT_COLLECTIONS:
+        sort_type, status_filter = EXPORT_COLLECTIONS[collection]
+
+        async def fetch_page(page):
+            return await _fetch_collection(sort_type, status_filter, page=page, per_page=per_page, cache=False)
+    else:
+        raise HTTPException(status_code=404, detail=f"Unknown collection '{collection}'")
+    return StreamingResponse(_export_lines(fetch_page, cursor, max_pages), media_type="application/x-ndjson")
+
+
 # ─── Anime Details ───────────────────────────────────────────────────────────
 
+async def _fetch_media(anilist_id: int, gql: str, variables: dict) -> dict:
+    """Run a `Media(id: $id)` query and return the media, remembering unknown ids."""
+    key = ("media", anilist_id)
+    # Upstream failures are only remembered for this exact query, so a failed
+    # characters page doesn't take /info for the same id down with it.
+    error_key = ("media", _query_key(gql, variables))
+    _negative_get(key)
+    _negative_get(error_key)
+    try:
+        data = await _anilist_query(gql, variables)
+    except HTTPException as e:
+        if e.status_code != 404:
+            _negative_set(error_key, e)
+            raise
+        data = {}
+    media = data.get("Media")
+    if not media:
+        error = HTTPException(status_code=404, detail="Anime not found")
+        _negative_set(key, error)
+        raise error
+    return media
+
+
+_INFO_QUERY = f"""
+query ($id: Int) {{
+    Media(id: $id, type: ANIME) {{
+        {MEDIA_FULL_FIELDS}
+    }}
+}}
+"""
+INFO_CHARACTERS = 25
+INFO_RECOMMENDATIONS = 10
+
+
+async def _fetch_info(anilist_id: int) -> dict:
+    """The full /info media, shared (via the AniList cache) by the detail sub-endpoints."""
+    return await _fetch_media(anilist_id, _INFO_QUERY, {"id": anilist_id})
+
+
+def _first_page(connection: dict, items: list, per_page: int) -> dict:
+    """Page 1 of `per_page` cut from the first page of a larger AniList connection."""
+    page_info = connection.get("pageInfo") or {}
+    return {
+        "page": 1,
+        "perPage": per_page,
+        "total": page_info.get("total", len(items)),
+        "hasNextPage": len(items) > per_page or page_info.get("hasNextPage", False),
+    }
+
+
 @app.get("/info/{anilist_id}")
 async def get_anime_info(anilist_id: int):
     """Get complete anime page data — everything AniList has to offer."""
-    gql = f"""
-    query ($id: Int) {{
-        Media(id: $id, type: ANIME) {{
-            {MEDIA_FULL_FIELDS}
-        }}
+    return _info_response(await _fetch_info(anilist_id))
+
+
+def _info_response(media: dict) -> dict:
+    _index_titles([media])
+    chars = media.get("characters") or {}
+    media = {**media, "characters": {
+        **chars,
+        "edges": [{k: v for k, v in edge.items() if k != "allVoiceActors"} for edge in chars.get("edges") or []],
     }}
-    """
-    data = await _anilist_query(gql, {"id": anilist_id})
-    media = data.get("Media")
-    if not media:
-        raise HTTPException(status_code=404, detail="Anime not found")
     return _proxy_deep_images(media)
 
 
@@ -815,6 +2283,16 @@ async def get_anime_characters(
     per_page: int = Query(25, ge=1, le=50),
 ):
     """Get paginated character list with voice actors for an anime."""
+    if page == 1 and per_page <= INFO_CHARACTERS:
+        chars = (await _fetch_info(anilist_id)).get("characters") or {}
+        edges = chars.get("edges") or []
+        response = _first_page(chars, edges, per_page)
+        response["characters"] = [
+            {"role": e.get("role"), "node": e.get("node"), "voiceActors": e.get("allVoiceActors")}
+            for e in edges[:per_page]
+        ]
+        return _proxy_deep_images(response)
+
     gql = """
     query ($id: Int, $page: Int, $perPage: Int) {
         Media(id: $id, type: ANIME) {
@@ -846,10 +2324,7 @@ async def get_anime_characters(
         }
     }
     """
-    data = await _anilist_query(gql, {"id": anilist_id, "page": page, "perPage": per_page})
-    media = data.get("Media")
-    if not media:
-        raise HTTPException(status_code=404, detail="Anime not found")
+    media = await _fetch_media(anilist_id, gql, {"id": anilist_id, "page": page, "perPage": per_page})
     chars = media.get("characters", {})
     page_info = chars.get("pageInfo", {})
     response = {
@@ -865,42 +2340,12 @@ async def get_anime_characters(
 @app.get("/anime/{anilist_id}/relations")
 async def get_anime_relations(anilist_id: int):
     """Get all related anime/manga for an anime (sequels, prequels, side stories, etc.)."""
-    gql = """
-    query ($id: Int) {
-        Media(id: $id, type: ANIME) {
-            id
-            title { romaji english }
-            relations {
-                edges {
-                    relationType(version: 2)
-                    node {
-                        id
-                        title { romaji english native }
-                        coverImage { large }
-                        bannerImage
-                        format
-                        type
-                        status
-                        episodes
-                        chapters
-                        meanScore
-                        averageScore
-                        popularity
-                        startDate { year month day }
-                    }
-                }
-            }
-        }
-    }
-    """
-    data = await _anilist_query(gql, {"id": anilist_id})
-    media = data.get("Media")
-    if not media:
-        raise HTTPException(status_code=404, detail="Anime not found")
+    media = await _fetch_info(anilist_id)
+    title = media.get("title") or {}
     response = {
         "id": media["id"],
-        "title": media["title"],
-        "relations": media.get("relations", {}).get("edges", []),
+        "title": {"romaji": title.get("romaji"), "english": title.get("english")},
+        "relations": (media.get("relations") or {}).get("edges", []),
     }
     return _proxy_deep_images(response)
 
@@ -912,6 +2357,13 @@ async def get_anime_recommendations(
     per_page: int = Query(10, ge=1, le=25),
 ):
     """Get paginated community recommendations for an anime."""
+    if page == 1 and per_page <= INFO_RECOMMENDATIONS:
+        recs = (await _fetch_info(anilist_id)).get("recommendations") or {}
+        nodes = recs.get("nodes") or []
+        response = _first_page(recs, nodes, per_page)
+        response["recommendations"] = nodes[:per_page]
+        return _proxy_deep_images(response)
+
     gql = """
     query ($id: Int, $page: Int, $perPage: Int) {
         Media(id: $id, type: ANIME) {
@@ -940,10 +2392,7 @@ async def get_anime_recommendations(
         }
     }
     """
-    data = await _anilist_query(gql, {"id": anilist_id, "page": page, "perPage": per_page})
-    media = data.get("Media")
-    if not media:
-        raise HTTPException(status_code=404, detail="Anime not found")
+    media = await _fetch_media(anilist_id, gql, {"id": anilist_id, "page": page, "perPage": per_page})
     recs = media.get("recommendations", {})
     page_info = recs.get("pageInfo", {})
     response = {
@@ -959,18 +2408,95 @@ async def get_anime_recommendations(
 # ─── Streaming (Pipe-based — unchanged logic) ───────────────────────────────
 
 @app.get("/episodes/{anilist_id}")
-async def get_episodes(anilist_id: int):
-    """Get the episode list for an anime, with slugified source IDs."""
-    data = await _fetch_raw_episodes(anilist_id)
-    return _proxy_deep_images(_inject_source_slugs(data, anilist_id))
+async def get_episodes(
+    request: Request,
+    anilist_id: int,
+    since: Optional[str] = Query(None, description="version from a previous response — only return what changed"),
+):
+    """Get the episode list for an anime, with slugified source IDs.
+
+    Every response carries a `version` (plus a hash per provider/category in
+    `versions`). Polling with `since=<version>` returns 304 when nothing
+    changed, otherwise only added/changed episodes and removed numbers.
+    """
+    snapshot = await _episode_snapshot(anilist_id)
+    version = snapshot["version"]
+    etag = f'"{version}"'
+    if since == version or request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    delta = _episode_delta(snapshot, since) if since else None
+    if delta is not None:
+        sliced = _inject_source_slugs({"providers": delta["providers"]}, anilist_id)
+        response = {"version": version, "since": since, "delta": True, "providers": sliced["providers"], "removed": delta["removed"]}
+    else:
+        response = _inject_source_slugs(snapshot["data"], anilist_id)
+        response.update(version=version, versions=snapshot["hashes"])
+        if since:
+            response["delta"] = False  # unknown or expired version: full list
+    return JSONResponse(_proxy_deep_images(response), headers={"ETag": etag})
+
+
+def _error_part(e: Exception, detail: str = "Upstream request failed") -> dict:
+    """Per-item error entry for responses that combine several upstream results."""
+    if isinstance(e, HTTPException):
+        return {"error": {"status": e.status_code, "detail": e.detail}}
+    return {"error": {"status": 502, "detail": detail}}
+
+
+EPISODES_BATCH_MAX = int(os.getenv("EPISODES_BATCH_MAX", "50"))
+EPISODES_BATCH_CONCURRENCY = int(os.getenv("EPISODES_BATCH_CONCURRENCY", "8"))
+
+
+def _summarize_episodes(data: dict) -> dict:
+    """Reduce an episode payload to latest episode number and count per provider/category."""
+    summary = {}
+    for provider_name, category, ep_list in _episode_lists(data):
+        if isinstance(ep_list, _EpisodeList):
+            numbers = [n for n in ep_list.column("number") if isinstance(n, (int, float))]
+        else:
+            numbers = [ep["number"] for ep in ep_list if isinstance(ep, dict) and isinstance(ep.get("number"), (int, float))]
+        summary.setdefault(provider_name, {})[category] = {"latest": max(numbers, default=None), "count": len(ep_list)}
+    return {"mappings": data.get("mappings"), "providers": summary}
+
+
+@app.get("/episodes")
+async def get_episodes_batch(
+    ids: str = Query(..., description="Comma-separated AniList IDs, e.g. 21,20,178005"),
+    summary: bool = Query(False, description="Only return latest episode number and count per provider/category"),
+):
+    """Get episode lists for many anime at once, keyed by AniList ID, with per-item errors."""
+    try:
+        anilist_ids = list(dict.fromkeys(int(i) for i in ids.split(",") if i.strip()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids must be comma-separated integers")
+    if not anilist_ids or len(anilist_ids) > EPISODES_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"Pass between 1 and {EPISODES_BATCH_MAX} ids")
+
+    semaphore = asyncio.Semaphore(EPISODES_BATCH_CONCURRENCY)
+
+    async def fetch_one(anilist_id: int):
+        async with semaphore:
+            try:
+                data = await _fetch_raw_episodes(anilist_id)
+            except Exception as e:
+                return _error_part(e, "Pipe request failed")
+        if summary:
+            return _summarize_episodes(data)
+        return _proxy_deep_images(_inject_source_slugs(data, anilist_id))
+
+    results = await asyncio.gather(*(fetch_one(i) for i in anilist_ids))
+    return {"results": {str(i): r for i, r in zip(anilist_ids, results)}}
 
 
 @app.get("/sources")
 async def get_sources(
+    request: Request,
     episodeId: str = Query(..., description="Plain-text episode ID from /episodes response"),
     provider: str = Query(..., description="Provider name, e.g. kiwi, arc, telli"),
     anilistId: int = Query(..., description="AniList anime ID"),
     category: str = Query("sub", description="sub or dub"),
+    proxy: bool = Query(False, description="Rewrite stream URLs to go through /proxy/hls"),
 ):
     """Get M3U8 streaming sources for a specific episode."""
     enc_id = base64.urlsafe_b64encode(episodeId.encode()).decode().rstrip('=')
@@ -987,15 +2513,30 @@ async def get_sources(
         "version": "0.1.0",
     }
     encoded_req = _encode_pipe_request(payload)
-    async with httpx.AsyncClient(timeout=15.0) as client:
-        res = await client.get(f"{MIRURO_PIPE_URL}?e={encoded_req}", headers=HEADERS)
-        if res.status_code != 200:
-            raise HTTPException(status_code=res.status_code, detail="Pipe request failed")
-        return _proxy_deep_images(_decode_pipe_response(res.text.strip()))
+    async with _UPSTREAMS["pipe"].slot() as timeout:
+        _METRICS["pipe_requests"] += 1
+        res = await _http().get(f"{MIRURO_PIPE_URL}?e={encoded_req}", headers=HEADERS, timeout=timeout)
+    if res.status_code != 200:
+        raise HTTPException(status_code=res.status_code, detail="Pipe request failed")
+    data = _decode_pipe_response(res.text.strip())
+    if proxy:
+        for stream in data.get("streams") or []:
+            if isinstance(stream, dict) and stream.get("url"):
+                stream["url"] = _hls_proxy_url(stream["url"], _hls_proxy_base(request))
+    return _proxy_deep_images(data)
 
 @app.get("/watch/{provider}/{anilist_id}/{category}/{slug}")
-async def get_watch_sources(provider: str, anilist_id: int, category: str, slug: str):
+async def get_watch_sources(
+    request: Request,
+    provider: str,
+    anilist_id: int,
+    category: str,
+    slug: str,
+    proxy: bool = Query(False, description="Rewrite stream URLs to go through /proxy/hls"),
+):
     """The super simple sources endpoint resolving slugs (prefix-number) back to provider IDs."""
+    miss_key = ("slug", provider, anilist_id, category, slug)
+    _negative_get(miss_key)
     data = await _fetch_raw_episodes(anilist_id)
     prov_data = data.get("providers", {}).get(provider, {})
     ep_list = prov_data.get("episodes", {}).get(category, [])
@@ -1011,6 +2552,371 @@ async def get_watch_sources(provider: str, anilist_id: int, category: str, slug:
             break
             
     if not target_id:
-        raise HTTPException(status_code=404, detail=f"Episode slug '{slug}' not found for provider {provider}")
+        error = HTTPException(status_code=404, detail=f"Episode slug '{slug}' not found for provider {provider}")
+        _negative_set(miss_key, error)
+        raise error
         
-    return await get_sources(episodeId=target_id, provider=provider, anilistId=anilist_id, category=category)
+    return await get_sources(request, episodeId=target_id, provider=provider, anilistId=anilist_id, category=category, proxy=proxy)
+
+
+# ─── Watch Page ──────────────────────────────────────────────────────────────
+
+def _pick_episode(data: dict, provider: Optional[str], category: str, number: Optional[float]):
+    """(provider, episode) for episode `number` (default: the first) in `category`, from `provider` if given."""
+    for provider_name, list_category, ep_list in _episode_lists(data):
+        if list_category != category or (provider and provider_name != provider):
+            continue
+        for ep in ep_list:
+            if isinstance(ep, dict) and ep.get("id") and (number is None or ep.get("number") == number):
+                return provider_name, ep
+    return None, None
+
+
+@app.get("/anime/{anilist_id}/full")
+async def get_anime_full(
+    request: Request,
+    anilist_id: int,
+    sources: bool = Query(False, description="Also resolve streaming sources for one episode"),
+    episode: Optional[float] = Query(None, description="Episode number for sources (default: first; implies sources=true)"),
+    provider: Optional[str] = Query(None, description="Provider for sources (default: first one with the episode)"),
+    category: str = Query("sub", description="sub or dub"),
+    proxy: bool = Query(False, description="Rewrite stream URLs to go through /proxy/hls"),
+):
+    """/info, /episodes and optionally sources in one round trip, with per-part errors.
+
+    Info and episodes are fetched concurrently; sources follow as soon as the
+    episode list is in, still alongside the info query.
+    """
+    want_sources = sources or episode is not None
+
+    async def info_part():
+        try:
+            return _info_response(await _fetch_info(anilist_id))
+        except Exception as e:
+            return _error_part(e)
+
+    async def watch_parts():
+        try:
+            snapshot = await _episode_snapshot(anilist_id)
+        except Exception as e:
+            error = _error_part(e, "Pipe request failed")
+            return error, error if want_sources else None
+        episodes = _inject_source_slugs(snapshot["data"], anilist_id)
+        episodes.update(version=snapshot["version"], versions=snapshot["hashes"])
+        episodes = _proxy_deep_images(episodes)
+        if not want_sources:
+            return episodes, None
+
+        provider_name, ep = _pick_episode(snapshot["data"], provider, category, episode)
+        if ep is None:
+            return episodes, {"error": {"status": 404, "detail": "No matching episode to resolve sources for"}}
+        try:
+            data = await get_sources(
+                request, episodeId=ep["id"], provider=provider_name, anilistId=anilist_id, category=category, proxy=proxy,
+            )
+        except Exception as e:
+            return episodes, _error_part(e, "Pipe request failed")
+        prefix = ep["id"].split(":")[0]
+        slug = f"watch/{provider_name}/{anilist_id}/{category}/{prefix}-{ep.get('number')}"
+        return episodes, {"provider": provider_name, "category": category, "number": ep.get("number"), "id": slug, **data}
+
+    info, (episodes, source_part) = await asyncio.gather(info_part(), watch_parts())
+    response = {"info": info, "episodes": episodes}
+    if want_sources:
+        response["sources"] = source_part
+    return response
+
+
+# ─── HLS Proxy ───────────────────────────────────────────────────────────────
+#
+# Players cannot fetch stream URLs directly (Referer checks, CORS), so
+# /proxy/hls fetches them with our HEADERS. Playlists are rewritten so every
+# URI points back through the proxy; segments are streamed chunk by chunk and
+# complete ones are kept in a size-bounded on-disk LRU so hot episodes are
+# served locally.
+#
+# The proxy only fetches URLs it handed out itself: /sources and rewritten
+# playlists sign every URL (HMAC with HLS_PROXY_SECRET), and each hop,
+# redirects included, must resolve to public addresses only.
+
+HLS_CACHE_DIR = os.getenv("HLS_CACHE_DIR", os.path.join(tempfile.gettempdir(), "miruro-hls"))
+HLS_CACHE_MAX_MB = int(os.getenv("HLS_CACHE_MAX_MB", "512"))
+HLS_SEGMENT_MAX_MB = int(os.getenv("HLS_SEGMENT_MAX_MB", "16"))
+HLS_PROXY_HOSTS = tuple(h.strip() for h in os.getenv("HLS_PROXY_HOSTS", "").split(",") if h.strip())
+# Several workers/instances must share one secret, or URLs signed by one are rejected by another
+HLS_PROXY_SECRET = os.getenv("HLS_PROXY_SECRET", "").encode() or os.urandom(32)
+# Public base URL of this API for the rewritten URLs (default: the URL the request came in on)
+HLS_PROXY_BASE = os.getenv("HLS_PROXY_BASE", IMAGE_PROXY_BASE).rstrip("/")
+HLS_MAX_REDIRECTS = 5
+HLS_CHUNK_SIZE = 64 * 1024
+
+_hls_cache = _DiskCache(HLS_CACHE_DIR, HLS_CACHE_MAX_MB)
+_HLS_PASS_HEADERS = (
+    "content-type", "content-length", "content-encoding", "content-range", "accept-ranges", "last-modified", "etag",
+)
+_HLS_URI_ATTR = re.compile(r'URI="([^"]+)"')
+
+
+def _hls_signature(url: str) -> str:
+    return hmac.new(HLS_PROXY_SECRET, url.encode(), hashlib.sha256).hexdigest()[:32]
+
+
+def _hls_proxy_base(request: Request) -> str:
+    return HLS_PROXY_BASE or str(request.base_url).rstrip("/")
+
+
+def _hls_proxy_url(url: str, base: str) -> str:
+    """Absolute, signed /proxy/hls URL for `url`; `base` is this API's public URL."""
+    return f"{base}/proxy/hls?url={quote(url, safe='')}&sig={_hls_signature(url)}"
+
+
+def _rewrite_playlist(text: str, base_url: str, proxy_base: str) -> str:
+    """Point every URI in an m3u8 playlist (segments, variants, keys, maps) at the proxy."""
+    lines = []
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped:
+            lines.append(line)
+        elif stripped.startswith("#"):
+            lines.append(_HLS_URI_ATTR.sub(
+                lambda m: f'URI="{_hls_proxy_url(urljoin(base_url, m.group(1)), proxy_base)}"', line,
+            ))
+        else:
+            lines.append(_hls_proxy_url(urljoin(base_url, stripped), proxy_base))
+    return "\n".join(lines) + "\n"
+
+
+def _is_public_ip(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%")[0])
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+async def _check_hls_target(url: str):
+    """Raise unless `url` is http(s) on an allowed host that resolves to public addresses only."""
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise HTTPException(status_code=400, detail="url must be an absolute http(s) URL")
+    if HLS_PROXY_HOSTS and not any(parts.hostname == h or parts.hostname.endswith("." + h) for h in HLS_PROXY_HOSTS):
+        raise HTTPException(status_code=403, detail="Host not allowed")
+    try:
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        infos = await asyncio.get_running_loop().getaddrinfo(parts.hostname, port, type=socket.SOCK_STREAM)
+    except (OSError, UnicodeError, ValueError):
+        raise HTTPException(status_code=502, detail="Upstream host did not resolve")
+    if not infos or not all(_is_public_ip(info[4][0]) for info in infos):
+        raise HTTPException(status_code=403, detail="Host not allowed")
+
+
+def _is_playlist(url: str, content_type: str) -> bool:
+    return "mpegurl" in content_type.lower() or urlsplit(url).path.lower().endswith(".m3u8")
+
+
+@app.get("/proxy/hls")
+async def proxy_hls(
+    request: Request,
+    url: str = Query(..., description="Absolute playlist or segment URL"),
+    sig: str = Query(..., description="Signature from the URL /sources or a proxied playlist handed out"),
+):
+    """Stream an HLS playlist or segment through the API with the upstream Referer."""
+    if not hmac.compare_digest(sig.encode(), _hls_signature(url).encode()):
+        raise HTTPException(status_code=403, detail="Invalid or missing signature")
+
+    key = hashlib.sha256(url.encode()).hexdigest()
+    cached = _hls_cache.get(key)
+    if cached:
+        # FileResponse handles Range requests and streams from disk
+        return FileResponse(cached[0], media_type=cached[1], headers={"Cache-Control": "public, max-age=86400"})
+
+    headers = dict(HEADERS)
+    range_header = request.headers.get("range")
+    if range_header:
+        headers["Range"] = range_header
+    # The body is passed through undecoded, so only ask for encodings the player accepts
+    headers["Accept-Encoding"] = request.headers.get("accept-encoding", "identity")
+    client = _http()
+    target = url
+    for _ in range(HLS_MAX_REDIRECTS + 1):
+        await _check_hls_target(target)  # every hop, so a redirect can't reach internal hosts
+        try:
+            # The slot covers the request up to the response headers; bodies are
+            # paced by the client and are not counted against the limit.
+            async with _UPSTREAMS["hls"].slot() as timeout:
+                upstream_request = client.build_request("GET", target, headers=headers, timeout=timeout)
+                upstream = await client.send(upstream_request, stream=True, follow_redirects=False)
+        except httpx.HTTPError:
+            raise HTTPException(status_code=502, detail="Upstream stream request failed")
+        if not upstream.is_redirect:
+            break
+        await upstream.aclose()
+        target = urljoin(target, upstream.headers.get("location", ""))
+    else:
+        raise HTTPException(status_code=502, detail="Too many upstream redirects")
+
+    content_type = upstream.headers.get("content-type", "application/octet-stream")
+    if upstream.status_code == 200 and _is_playlist(str(upstream.url), content_type):
+        try:
+            text = (await upstream.aread()).decode("utf-8", errors="replace")
+        finally:
+            await upstream.aclose()
+        return Response(
+            _rewrite_playlist(text, str(upstream.url), _hls_proxy_base(request)),
+            media_type="application/vnd.apple.mpegurl",
+            headers={"Cache-Control": "no-cache"},
+        )
+
+    length = int(upstream.headers.get("content-length") or 0)
+    encoded = upstream.headers.get("content-encoding", "identity").lower() != "identity"
+    cacheable = (
+        upstream.status_code == 200 and not range_header and not encoded
+        and 0 < length <= HLS_SEGMENT_MAX_MB * 1024 * 1024
+    )
+
+    async def body():
+        tmp_path = _hls_cache.temp_path(key) if cacheable else None
+        tmp = open(tmp_path, "wb") if tmp_path else None
+        size = 0
+        try:
+            # Raw bytes, so they match the content-length/-encoding passed through
+            async for chunk in upstream.aiter_raw(HLS_CHUNK_SIZE):
+                if tmp:
+                    tmp.write(chunk)
+                size += len(chunk)
+                yield chunk
+            if tmp:
+                tmp.close()
+                tmp = None
+                if size == length:
+                    _hls_cache.add(key, tmp_path, size, content_type)
+                    tmp_path = None
+        finally:
+            if tmp:
+                tmp.close()
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            await upstream.aclose()
+
+    passed = {k: v for k, v in upstream.headers.items() if k.lower() in _HLS_PASS_HEADERS}
+    passed["Cache-Control"] = "public, max-age=86400"
+    return StreamingResponse(
+        body(), status_code=upstream.status_code, headers=passed,
+        # Also covers clients that disconnect before the body is ever iterated
+        background=BackgroundTask(upstream.aclose),
+    )
+
+
+# ─── Image Proxy ─────────────────────────────────────────────────────────────
+#
+# /img serves AniList covers, banners and character images from a disk cache
+# keyed by a hash of (url, width). AniList image URLs never change content,
+# so responses are marked immutable. Images are streamed to disk rather than
+# buffered. With Pillow installed, ?w= returns a WebP resized to the nearest
+# allowed width — handy for grid thumbnails.
+
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "miruro-img"))
+IMAGE_CACHE_MAX_MB = int(os.getenv("IMAGE_CACHE_MAX_MB", "256"))
+IMAGE_WIDTHS = (100, 150, 200, 300, 460, 720, 1080)
+IMAGE_CHUNK_SIZE = 64 * 1024
+
+_image_cache = _DiskCache(IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_MB)
+_IMMUTABLE = {"Cache-Control": "public, max-age=31536000, immutable"}
+
+
+_pil_image = None  # PIL.Image once imported, False if Pillow is not installed
+
+
+def _pillow():
+    """Import Pillow on first use — it is optional and slow to import."""
+    global _pil_image
+    if _pil_image is None:
+        try:
+            from PIL import Image
+            _pil_image = Image
+        except ImportError:
+            _pil_image = False
+    return _pil_image
+
+
+def _resize_image(src: str, dst: str, width: int) -> int:
+    """Downscale the image file `src` to `width` (never upscale) as WebP into `dst`; returns its size."""
+    Image = _pillow()
+    with Image.open(src) as img:
+        if img.width > width:
+            img = img.resize((width, round(img.height * width / img.width)), Image.LANCZOS)
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if "transparency" in img.info else "RGB")
+        img.save(dst, "WEBP", quality=80, method=4)
+    return os.path.getsize(dst)
+
+
+async def _fetch_image(url: str, width: Optional[int], key: str):
+    """Stream (and optionally resize) an image into the cache; returns (path, content type)."""
+    tmp_path = _image_cache.temp_path(key)
+    size = 0
+    try:
+        async with _UPSTREAMS["images"].slot() as timeout:
+            try:
+                async with _http().stream("GET", url, headers=HEADERS, follow_redirects=True, timeout=timeout) as res:
+                    if res.status_code != 200:
+                        raise HTTPException(status_code=404 if res.status_code == 404 else 502, detail="Image fetch failed")
+                    content_type = res.headers.get("content-type", "image/jpeg")
+                    with open(tmp_path, "wb") as f:
+                        async for chunk in res.aiter_bytes(IMAGE_CHUNK_SIZE):
+                            f.write(chunk)
+                            size += len(chunk)
+            except httpx.HTTPError:
+                raise HTTPException(status_code=502, detail="Image fetch failed")
+        if width:
+            resized_path = _image_cache.temp_path(key)
+            try:
+                size = await asyncio.to_thread(_resize_image, tmp_path, resized_path, width)
+                os.replace(resized_path, tmp_path)
+                content_type = "image/webp"
+            except Exception:
+                if os.path.exists(resized_path):
+                    os.remove(resized_path)  # not decodable by Pillow — serve the original bytes
+        _image_cache.add(key, tmp_path, size, content_type)
+        tmp_path = None
+    finally:
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return _image_cache.get(key)
+
+
+@app.get("/img")
+async def proxy_image(
+    url: str = Query(..., description="AniList CDN image URL"),
+    w: Optional[int] = Query(None, ge=1, description="Target width (resized WebP, needs Pillow)"),
+):
+    """Cached image proxy for AniList covers, banners and character images."""
+    if not url.startswith(_IMAGE_URL_PREFIXES):
+        raise HTTPException(status_code=403, detail="Host not allowed")
+    width = None
+    if w and _pillow():
+        width = next((allowed for allowed in IMAGE_WIDTHS if allowed >= w), IMAGE_WIDTHS[-1])
+    key = hashlib.sha256(f"{url}|{width or ''}".encode()).hexdigest()
+
+    cached = _image_cache.get(key) or await _singleflight(("img", key), lambda: _fetch_image(url, width, key))
+    if cached is None:
+        raise HTTPException(status_code=502, detail="Image cache unavailable")
+    return FileResponse(cached[0], media_type=cached[1], headers={**_IMMUTABLE, "ETag": f'"{key[:32]}"'})
+
+
+# ─── Metrics ─────────────────────────────────────────────────────────────────
+
+@app.get("/metrics")
+async def get_metrics():
+    """Counters (upstream calls, cache hits, cold start time, ...) and cache sizes."""
+    return {
+        "counters": dict(_METRICS),
+        "caches": {
+            "anilist": len(_anilist_cache),
+            "episodes": len(_episode_snapshots),
+            "suggestions": len(_suggest_entries),
+            "negative": len(_negative_cache),
+        },
+        "anilistBudgetLeft": _anilist_budget_left(),
+        "upstreams": {name: upstream.stats() for name, upstream in _UPSTREAMS.items()},
+        "prefetch": {"active": PREFETCH_ENABLED and _prefetch_active(), "hitRate": _prefetch_hit_rate()},
+    }
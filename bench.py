@@ -0,0 +1,131 @@
+"""Micro-benchmarks for hot paths in api.py.
+
+    python bench.py
+
+Runs without network access; upstream calls are never made.
+"""
+import asyncio, os, time, tracemalloc
+
+os.environ.setdefault("ALLOWED_ORIGINS", ",".join(f"https://site{i}.example" for i in range(20)) + ",https://www.miruro.tv")
+os.environ.setdefault("API_KEY", "bench-key")
+
+import api
+from fastapi.responses import JSONResponse
+from starlette.middleware.base import BaseHTTPMiddleware
+
+
+async def _ok_app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"text/plain")]})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+
+async def _legacy_secure_api(request, call_next):
+    # The @app.middleware("http") version this replaced, kept for comparison
+    if request.url.path in ["/", "/docs", "/redoc", "/openapi.json"]:
+        return await call_next(request)
+    api_key = request.headers.get(api.API_KEY_NAME)
+    if api.VALID_API_KEY and api_key == api.VALID_API_KEY:
+        return await call_next(request)
+    origin = request.headers.get("origin")
+    referer = request.headers.get("referer")
+    is_allowed = False
+    for allowed in api.ALLOWED_ORIGINS:
+        if (origin and origin.startswith(allowed)) or (referer and referer.startswith(allowed)):
+            is_allowed = True
+            break
+    if not is_allowed:
+        return JSONResponse(status_code=403, content={"detail": "Access forbidden: Invalid Origin, Referer, or API Key."})
+    return await call_next(request)
+
+
+def _scope(headers):
+    return {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": "/trending", "raw_path": b"/trending", "query_string": b"",
+        "root_path": "", "headers": headers, "client": ("127.0.0.1", 1), "server": ("127.0.0.1", 80),
+    }
+
+
+async def _drive(app, headers, n):
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    start = time.perf_counter()
+    for _ in range(n):
+        await app(_scope(headers), receive, send)
+    return (time.perf_counter() - start) / n * 1e6
+
+
+def bench_middleware(n=20000):
+    cases = {
+        "allowed origin (last entry)": [(b"origin", b"https://www.miruro.tv")],
+        "api key": [(b"x-api-key", b"bench-key")],
+        "rejected": [(b"referer", b"https://evil.example/page")],
+    }
+    legacy = BaseHTTPMiddleware(_ok_app, dispatch=_legacy_secure_api)
+    current = api.SecureAPIMiddleware(_ok_app)
+    print(f"secure_api middleware, {n} requests per case (us/request)")
+    for name, headers in cases.items():
+        old = asyncio.run(_drive(legacy, headers, n))
+        new = asyncio.run(_drive(current, headers, n))
+        print(f"  {name:28} BaseHTTPMiddleware {old:7.2f}   ASGI {new:6.2f}   x{old / new:.1f}")
+
+
+def _episode_payload(providers=4, categories=("sub", "dub"), episodes=1000):
+    return {
+        "mappings": {"anilistId": 21},
+        "providers": {
+            f"provider{p}": {
+                "episodes": {
+                    category: [
+                        {
+                            "id": f"animepahe:{p}{i}:{category}{i * 7919}",
+                            "number": i,
+                            "title": f"Episode {i}",
+                            "image": f"https://serveproxy.com/url?url=https://i.example/{p}/{i}.jpg",
+                            "airDate": f"2020-01-{i % 28 + 1:02d}",
+                            "duration": 1420,
+                            "description": f"Episode {i} description",
+                            "filler": i % 10 == 0,
+                        }
+                        for i in range(1, episodes + 1)
+                    ]
+                    for category in categories
+                }
+            }
+            for p in range(providers)
+        },
+    }
+
+
+def _measure(build):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return kept, size
+
+
+def _plain_snapshot(payload):
+    # What the episode cache held before _EpisodeList: the same snapshot with the raw dicts
+    return {**api._build_snapshot(payload), "data": payload}
+
+
+def bench_episode_memory(anime=20):
+    # Each case builds fresh upstream payloads and keeps only what the episode
+    # cache keeps: the full _build_snapshot() output (data, digests, history)
+    total = anime * 4 * 2 * 1000
+    _, plain = _measure(lambda: [_plain_snapshot(_episode_payload()) for _ in range(anime)])
+    _, compact = _measure(lambda: [api._build_snapshot(_episode_payload()) for _ in range(anime)])
+    print(f"cached episode snapshots, {total} episodes (bytes/episode)")
+    print(f"  plain dicts    {plain / total:7.1f}")
+    print(f"  _EpisodeList   {compact / total:7.1f}   x{plain / compact:.2f}")
+
+
+if __name__ == "__main__":
+    bench_middleware()
+    bench_episode_memory()
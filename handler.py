@@ -0,0 +1,86 @@
+"""AWS Lambda (and other Lambda-style) entry point: handler = "handler.handler".
+
+Keeps what a warm container already paid for — the imported app, the shared
+upstream client and the response caches — and persists those caches to /tmp.
+/tmp belongs to one execution environment, so the file is only read back when
+the runtime re-initializes inside it (e.g. after a crash or timeout).
+"""
+import time
+
+_import_started = time.perf_counter()
+
+import gzip, json, os
+from concurrent.futures import ThreadPoolExecutor
+
+from mangum import Mangum
+
+import api
+
+COLD_START_IMPORT_MS = round((time.perf_counter() - _import_started) * 1000, 1)
+
+CACHE_FILE = os.getenv("SERVERLESS_CACHE_FILE", "/tmp/miruro-cache.json.gz")
+CACHE_SAVE_INTERVAL = int(os.getenv("SERVERLESS_CACHE_SAVE_INTERVAL", "10"))
+CACHE_MAX_ENTRIES = int(os.getenv("SERVERLESS_CACHE_MAX_ENTRIES", "300"))
+
+_last_save = 0.0
+_saved_writes = 0
+_saver = ThreadPoolExecutor(max_workers=1)
+_saving = None  # Future of the save in progress
+
+
+def _load_cache():
+    global _saved_writes
+    try:
+        with gzip.open(CACHE_FILE, "rt") as f:
+            api._import_caches(json.load(f))
+        api._METRICS["tmp_cache_loads"] += 1
+    except (OSError, ValueError):
+        pass  # fresh execution environment, or a torn/old file
+    _saved_writes = api._cache_writes()
+
+
+def _save_cache():
+    """Queue a save if the caches changed, at most every CACHE_SAVE_INTERVAL seconds.
+
+    Encoding and compressing run on a worker thread so the response isn't
+    held up. If the container is frozen mid-save, the save finishes on the
+    next thaw, and the file is only ever replaced whole.
+    """
+    global _last_save, _saved_writes, _saving
+    writes = api._cache_writes()
+    if writes == _saved_writes or time.monotonic() - _last_save < CACHE_SAVE_INTERVAL:
+        return
+    if _saving is not None and not _saving.done():
+        return
+    _last_save = time.monotonic()
+    _saved_writes = writes
+    _saving = _saver.submit(_write_cache)
+
+
+def _write_cache():
+    global _saved_writes
+    tmp_path = f"{CACHE_FILE}.{os.getpid()}.tmp"
+    try:
+        # Cached values are never mutated in place, so reading them here is safe
+        with gzip.open(tmp_path, "wt", compresslevel=5) as f:
+            json.dump(api._export_caches(CACHE_MAX_ENTRIES), f, separators=(",", ":"))
+        os.replace(tmp_path, CACHE_FILE)
+    except OSError:
+        _saved_writes = -1  # retry on a later invocation
+
+
+_load_cache()
+api._METRICS["cold_start_import_ms"] = COLD_START_IMPORT_MS
+api._METRICS["cold_starts"] += 1
+print(json.dumps({"event": "cold_start", "import_ms": COLD_START_IMPORT_MS}))
+
+# No lifespan: background jobs (harvests, catalog sync) don't belong in a
+# function that is frozen between invocations.
+_asgi = Mangum(api.app, lifespan="off")
+
+
+def handler(event, context):
+    api._METRICS["invocations"] += 1
+    response = _asgi(event, context)
+    _save_cache()
+    return response